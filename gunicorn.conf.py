@@ -0,0 +1,15 @@
+import gc
+
+# Serve the dashboard with a bare `gunicorn` from the repository root
+wsgi_app = 'src.app:server'
+
+# Import the app, read the data and build the indexes once in the master process. Forked
+# workers then share those pages copy-on-write instead of each loading their own copy,
+# and new workers start without re-reading the data.
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far out of the garbage collector's reach, so collections
+    # in the workers do not touch (and thereby copy) the shared pages
+    gc.freeze()
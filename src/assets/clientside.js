@@ -0,0 +1,31 @@
+// Callbacks run in the browser instead of on the server, see the clientside_callback calls in src/app.py
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    spotify: {
+        // Years of the domain up to the selected end year
+        startYearOptions: function(endYear, years) {
+            if (endYear === null || endYear === undefined) {
+                return [];
+            }
+            return (years || []).filter(year => year <= endYear).map(year => ({label: year, value: year}));
+        },
+
+        // Years of the domain from the selected start year on
+        endYearOptions: function(startYear, years) {
+            if (startYear === null || startYear === undefined) {
+                return [];
+            }
+            return (years || []).filter(year => year >= startYear).map(year => ({label: year, value: year}));
+        },
+
+        // At most five selected artists
+        limitArtists: function(selectedArtists) {
+            if (selectedArtists === null || selectedArtists === undefined) {
+                return [];
+            }
+            if (selectedArtists.length > 5) {
+                return selectedArtists.slice(0, 5);
+            }
+            return window.dash_clientside.no_update;
+        }
+    }
+});
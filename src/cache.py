@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Number of rendered specs a DiskBackend keeps on disk, for all the workers of the machine
+DISK_MAX_ENTRIES = int(os.environ.get('SPOTIFY_SPEC_CACHE_DISK_SIZE', 1024))
+
+
+# Rendered chart specs keyed by the normalized query that produced them. Entries live in
+# an in-process LRU dictionary with a time-to-live, optionally backed by a shared
+# DiskBackend or RedisBackend so that other workers (and restarts) reuse them too.
+class SpecCache:
+    def __init__(self, max_entries=256, ttl=3600, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'backend_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, spec = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return spec
+                del self._entries[key]
+                self.stats['expirations'] += 1
+        if self.backend is not None:
+            spec = self.backend.get(_backend_key(key))
+            if spec is not None:
+                self._store(key, spec)
+                with self._lock:
+                    self.stats['backend_hits'] += 1
+                return spec
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def set(self, key, spec):
+        self._store(key, spec)
+        if self.backend is not None:
+            self.backend.set(_backend_key(key), spec, self.ttl)
+
+    # return the cached spec for key, rendering and caching it on a miss
+    def get_or_render(self, key, render):
+        spec = self.get(key)
+        if spec is None:
+            spec = render()
+            self.set(key, spec)
+        return spec
+
+    # backend=False only drops the entries of this process, leaving the shared ones to other workers
+    def clear(self, backend=True):
+        with self._lock:
+            self._entries.clear()
+        if backend and self.backend is not None:
+            self.backend.clear()
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, size=len(self._entries), max_entries=self.max_entries, ttl=self.ttl,
+                        backend=type(self.backend).__name__ if self.backend is not None else None)
+
+    def _store(self, key, spec):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, spec)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+
+def _backend_key(key):
+    return hashlib.sha256(json.dumps(key, default=str).encode()).hexdigest()
+
+
+# another worker may have deleted the file first
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Specs stored as JSON files in a local directory shared by the workers of one machine. Each
+# file's modification time is set to its expiry, so that every set deletes the expired files
+# and, past max_entries, the ones expiring first with a single stat per file.
+class DiskBackend:
+    def __init__(self, directory, max_entries=DISK_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        path = os.path.join(self.directory, f'{key}.json')
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if entry['expires'] < time.time():
+            _remove(path)
+            return None
+        return entry['spec']
+
+    def set(self, key, spec, ttl):
+        path = os.path.join(self.directory, f'{key}.json')
+        expires = time.time() + ttl
+        # write to a temporary file and rename so readers never see a partial entry
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'expires': expires, 'spec': spec}, file)
+        os.utime(tmp_path, (expires, expires))
+        os.replace(tmp_path, path)
+        self.prune()
+
+    # delete the expired entries, then the ones expiring first until max_entries are left
+    def prune(self):
+        now = time.time()
+        entries = []
+        with os.scandir(self.directory) as files:
+            for file in files:
+                if not file.name.endswith('.json'):
+                    continue
+                try:
+                    expires = file.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if expires < now:
+                    _remove(file.path)
+                else:
+                    entries.append((expires, file.path))
+        if len(entries) > self.max_entries:
+            entries.sort()
+            for _, path in entries[:len(entries) - self.max_entries]:
+                _remove(path)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                _remove(os.path.join(self.directory, name))
+
+
+# Specs stored in Redis (or any server speaking its protocol) shared by every machine
+class RedisBackend:
+    def __init__(self, url, prefix='spotify-spec:'):
+        try:
+            import redis
+        except ImportError as error:
+            raise ImportError('the redis package is required for a redis:// spec cache backend') from error
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, spec, ttl):
+        self.client.setex(self.prefix + key, int(ttl), json.dumps(spec))
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+# backend for SPOTIFY_SPEC_CACHE_BACKEND: a redis:// URL or a directory path
+def create_backend(location):
+    if not location:
+        return None
+    if location.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(location)
+    return DiskBackend(location)
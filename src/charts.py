@@ -0,0 +1,173 @@
+import os
+import src.cache as cache
+import src.metrics as metrics
+import src.specs as specs
+import src.utils as ut
+
+# Altair is only imported once the first chart is built
+alt = ut.lazy_import('altair')
+
+# Aggregate and fit the speechiness regression lines in pandas/NumPy instead of
+# embedding every matching track in the spec and letting Vega do it in the browser
+SERVER_SIDE_AGGREGATION = os.environ.get('SPOTIFY_SERVER_AGGREGATION', '1') != '0'
+# 'template' fills the Vega-Lite specs written out in specs.py; 'altair' builds them with
+# Altair, which also validates them, at several times the cost
+SPEC_BUILDER = os.environ.get('SPOTIFY_SPEC_BUILDER', 'template')
+# Maximum number of tracks drawn in the speechiness scatter; larger selections are down-sampled
+SCATTER_ROW_CAP = int(os.environ.get('SPOTIFY_SCATTER_ROW_CAP', 500))
+
+# Rendered specs, shared by every user asking for the same view
+spec_cache = cache.SpecCache(
+    max_entries=int(os.environ.get('SPOTIFY_SPEC_CACHE_SIZE', 256)),
+    ttl=float(os.environ.get('SPOTIFY_SPEC_CACHE_TTL', 3600)),
+    backend=cache.create_backend(os.environ.get('SPOTIFY_SPEC_CACHE_BACKEND'))
+)
+
+
+def artist_time_chart(popularity_df, selected_artists, start_year, end_year, compare_df=None, compare_artist=None,
+                      builder=None):
+    if (builder or SPEC_BUILDER) == 'template':
+        with metrics.phase('build'):
+            return specs.artist_time_chart(popularity_df, selected_artists, start_year, end_year, compare_df,
+                                           compare_artist)
+    with metrics.phase('build'):
+        chart = _artist_time_chart(popularity_df, selected_artists, start_year, end_year, compare_df, compare_artist)
+    with metrics.phase('serialize'):
+        return chart.to_dict()
+
+
+def _artist_time_chart(popularity_df, selected_artists, start_year, end_year, compare_df, compare_artist):
+    popularity_df = ut.decategorize(popularity_df)
+    unique_years = sorted(popularity_df['release_year'].unique())
+
+    chart = alt.Chart(popularity_df).mark_point().encode(
+        x=alt.X('release_year:Q',
+                scale=alt.Scale(domain=[int(start_year), int(end_year)]),
+                axis=alt.Axis(values=unique_years, format='0'),
+                title='Release Year'),
+        y=alt.Y('mean(popularity)', title='Popularity'),
+        color=alt.Color('artist', scale=alt.Scale(
+            domain=selected_artists,
+            range=['#FFEEAF', '#A8CD9F', '#57CC99', '#438A70', '#12372A']),
+                        legend=alt.Legend(title="Artist")),
+        tooltip=['artist', 'release_year', 'mean(popularity)']
+    ).properties(
+        # # title='Artist Popularity Over Time',
+        width=250,
+        height=180
+    )
+
+    chart = chart + chart.mark_line()
+    if compare_artist is not None:
+        compare_artist_chart = alt.Chart(ut.decategorize(compare_df)).mark_point(color='red').encode(
+            x='release_year:Q',
+            y=alt.Y('mean(popularity)', title='Popularity'),
+            color=alt.Color('artist', legend=alt.Legend(title="Compare"), scale=alt.Scale(domain=[compare_artist], range=['red'])),
+            tooltip=['artist', 'release_year', 'mean(popularity)']
+        )
+        compare_artist_layer = compare_artist_chart + compare_artist_chart.mark_line(color='red')
+        chart = alt.layer(chart, compare_artist_layer).resolve_scale(color='independent')
+    return chart
+
+
+def explicit_chart(merged_df, builder=None):
+    if (builder or SPEC_BUILDER) == 'template':
+        with metrics.phase('build'):
+            return specs.explicit_chart(merged_df)
+    with metrics.phase('build'):
+        chart = _explicit_chart(merged_df)
+    with metrics.phase('serialize'):
+        return chart.to_dict()
+
+
+def _explicit_chart(merged_df):
+    chart = alt.Chart(ut.decategorize(merged_df)).mark_bar().encode(
+        alt.X('song_type:N', axis=alt.Axis(title=None, labels=True, ticks=True), 
+                             sort=alt.SortArray(['Clean', 'Explicit']), 
+                             scale=alt.Scale(domain=['Clean', 'Explicit'])),
+        alt.Y('popularity:Q', axis=alt.Axis(title='Mean Popularity', grid=False)),
+        color=alt.Color('song_type:N', legend=alt.Legend(title="Song Type")).scale(scheme="greens"),
+        column=alt.Column('artist:N', header=alt.Header(title=None, labelOrient='bottom'))
+    ).configure_view(
+        stroke='transparent'
+    ).properties(
+        width=25,
+        height=170,
+        # title='Mean Popularity of Songs by Type and Artist'
+    ).transform_calculate(
+    adjusted_song_type=alt.expr.if_(alt.datum.song_type == 'Clean', 'C', 'E')
+).encode(
+    x=alt.X('adjusted_song_type:N', axis=alt.Axis(title=None, labels=True, ticks=True, labelAngle=0)),
+)
+
+    return chart
+
+
+def top_songs_chart(tracks_df_top_five, builder=None):
+    if (builder or SPEC_BUILDER) == 'template':
+        with metrics.phase('build'):
+            return specs.top_songs_chart(tracks_df_top_five)
+    with metrics.phase('build'):
+        chart = alt.Chart(ut.decategorize(tracks_df_top_five)).mark_bar().encode(
+            y=alt.Y('popularity', title="Popularity"),
+            x=alt.X('name', axis=alt.Axis(labelAngle=-15), title='Song Name').sort('-y'),
+            color=alt.Color('artist', legend=None).scale(scheme="greens"),
+            tooltip=['artist', 'release_year']
+        ).properties(
+            # title='Popularity of Top Songs',
+            width=350,
+            height=166
+        )
+    with metrics.phase('serialize'):
+        return chart.to_dict()
+
+
+def speechiness_chart(tracks_df_filtered, start_year, end_year, server_side=SERVER_SIDE_AGGREGATION,
+                      row_cap=SCATTER_ROW_CAP, builder=None):
+    with metrics.phase('aggregate'):
+        tracks_df_filtered = ut.decategorize(tracks_df_filtered).assign(
+            speechiness_label=tracks_df_filtered['speechiness_binned'].map({0: 'Low', 1: 'High'}))
+
+        unique_years = sorted(tracks_df_filtered['release_year'].unique())
+
+        if server_side:
+            scatter_df = ut.cap_rows(
+                tracks_df_filtered[['artist', 'name', 'release_year', 'popularity', 'speechiness_label']], row_cap)
+            # Regression lines are fitted on every matching track, not only the down-sampled points
+            lines_df = ut.fit_regression_lines(tracks_df_filtered, 'release_year', 'popularity', 'speechiness_label')
+        else:
+            scatter_df = tracks_df_filtered
+            lines_df = None
+
+    if (builder or SPEC_BUILDER) == 'template':
+        with metrics.phase('build'):
+            return specs.speechiness_chart(scatter_df, lines_df, unique_years, start_year, end_year)
+
+    with metrics.phase('build'):
+        chart = alt.Chart(scatter_df).mark_point(opacity=0.7).encode(
+            x=alt.X('release_year:Q',
+                    scale=alt.Scale(domain=[int(start_year), int(end_year)]),
+                    axis=alt.Axis(values=unique_years, format='0'),
+                    title='Release Year'),
+            y=alt.Y('popularity', title='Popularity'),
+            color=alt.Color('speechiness_label:N', legend=alt.Legend(title="Speechiness")).scale(scheme="greens"),
+            tooltip=['artist', 'name', 'release_year', 'popularity']
+        ).properties(
+            # title='Popularity by Speechiness over Time',
+            width=200,
+            height=180
+        )
+
+        if server_side:
+            lines = alt.Chart(lines_df).mark_line().encode(
+                x='release_year:Q',
+                y='popularity:Q',
+                color=alt.Color('speechiness_label:N').scale(scheme="greens")
+            )
+            fig = chart + lines
+        else:
+            fig = chart + chart.transform_regression('release_year', 'popularity',
+                                                     groupby=['speechiness_label']).mark_line()
+
+    with metrics.phase('serialize'):
+        return fig.to_dict()
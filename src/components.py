@@ -1,53 +1,254 @@
 from dash import html, dcc
-import pandas as pd
+from functools import lru_cache
+import os
+import threading
+import time
+import traceback
 import dash_bootstrap_components as dbc
+import src.metrics as metrics
+import src.tracks as trk
 import src.utils as ut
 import dash_vega_components as dvc
 
 
-tracks_df = pd.read_parquet('data/processed/tracks_processed.parquet')
+# SPOTIFY_DATA_MODE selects where the tracks live: 'dataset' keeps them on disk and reads only
+# the rows each query needs, anything else loads the table into memory (shared by the gunicorn
+# workers through preload_app, see gunicorn.conf.py)
+DATA_MODE = os.environ.get('SPOTIFY_DATA_MODE')
+# Seconds between checks of the data files for changes, 0 to never reload
+RELOAD_INTERVAL = float(os.environ.get('SPOTIFY_RELOAD_INTERVAL', 0))
 
-# Configuration
-genre_dropdown = dcc.Dropdown(
-    options=ut.create_genre_dropdown_options(tracks_df),
-    value="pop",
-    multi=False,
-    placeholder='Select a genre...',
-    id='genre-dropdown'
-)
+
+# Everything derived from the tracks data. A reload builds a complete new bundle and swaps it
+# in with one assignment to `data`, so code that reads `data` once sees a single version.
+class DataBundle:
+    def __init__(self, version, track_store, cube_df):
+        # Identifies the loaded data in cache keys that outlive this process
+        self.version = version
+        self.track_store = track_store
+        # Artist x release year x explicit aggregates written by src/preprocess.py
+        self.cube_df = cube_df
+        with ut.startup_phase('indexes'):
+            self.cube_index = ut.create_artist_index(cube_df)
+            # Mean audio features over every track of each artist, looked up by the comparison cards
+            artist_feature_df = ut.aggregate_cube(cube_df, ['artist'], ut.AUDIO_FEATURES)
+            self.artist_feature_df = artist_feature_df.set_index(
+                artist_feature_df['artist'].astype(str))[ut.AUDIO_FEATURES]
+        with ut.startup_phase('option construction'):
+            self.release_years = track_store.release_years()
+            self.genre_dropdown_options = ut.create_genre_dropdown_options(track_store.genre_counts())
+        with ut.startup_phase('indexes'):
+            self.genre_index = ut.create_genre_index(track_store.genre_artist_years())
+            self.artist_search_index = ut.create_artist_search_index(track_store.artist_popularity(cube_df))
+
+
+# Version of the data files on disk, compared against data.version to detect changes. In memory
+# it covers the cube too, since preprocess --append rewrites the cube alone.
+def current_version():
+    if DATA_MODE == 'dataset':
+        return ut.dataset_digest(ut.TRACKS_DATASET_PATH)
+    version = ut.file_digest(ut.TRACKS_PATH)
+    if os.path.exists(ut.CUBE_PATH):
+        version += ':' + ut.file_digest(ut.CUBE_PATH)
+    return version
+
+
+# Build a bundle from the data files. Given the bundle being replaced, a dataset that only
+# gained files is updated incrementally: only the new files are scanned and their aggregates
+# are added to the previous cube.
+def load_data(previous=None):
+    version = current_version()
+    if DATA_MODE == 'dataset':
+        track_store = trk.DatasetTracks(ut.TRACKS_DATASET_PATH,
+                                        previous.track_store if previous is not None else None)
+        if track_store.appended_files is not None:
+            cube_df = ut.merge_track_cubes([previous.cube_df, track_store.appended_cube()])
+        else:
+            cube_df = ut.load_track_cube(ut.CUBE_PATH, None)
+        return DataBundle(version, track_store, cube_df)
+
+    tracks_df = ut.load_tracks(ut.TRACKS_PATH)
+    with ut.startup_phase('indexes'):
+        track_store = trk.InMemoryTracks(tracks_df)
+        cube_df = ut.load_track_cube(ut.CUBE_PATH, track_store.tracks_df)
+    return DataBundle(version, track_store, cube_df)
+
+
+data = load_data()
+
+# Number of distinct (artists, start year, end year) slices kept per worker
+QUERY_CACHE_SIZE = 128
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _query_tracks(version, artists, start_year, end_year):
+    return data.track_store.query(artists, start_year, end_year)
+
+
+# Filter tracks by artist and release year range. Every "Plot!" callback asks for the
+# same slice, so results are shared through a bounded LRU cache keyed by the normalized
+# query; callers must treat the returned frame as read-only.
+def query_tracks(selected_artists, start_year, end_year):
+    with metrics.phase('filter'):
+        return _query_tracks(data.version, tuple(sorted(set(selected_artists))), int(start_year), int(end_year))
+
+
+# The k most popular tracks of the artists in the year range, most popular first
+def top_tracks(selected_artists, start_year, end_year, k=5):
+    with metrics.phase('aggregate'):
+        return data.track_store.top_tracks(sorted(set(selected_artists)), int(start_year), int(end_year), k)
+
+
+# Mean popularity per artist and release year
+def artist_year_popularity(selected_artists, start_year, end_year):
+    bundle = data
+    with metrics.phase('filter'):
+        cube_filtered = ut.filter_tracks(bundle.cube_df, bundle.cube_index, selected_artists, start_year, end_year)
+    with metrics.phase('aggregate'):
+        return ut.aggregate_cube(cube_filtered, ['artist', 'release_year'], ['popularity'])
+
+
+# Mean popularity per artist and explicit flag
+def artist_explicit_popularity(selected_artists, start_year, end_year):
+    bundle = data
+    with metrics.phase('filter'):
+        cube_filtered = ut.filter_tracks(bundle.cube_df, bundle.cube_index, selected_artists, start_year, end_year)
+    with metrics.phase('aggregate'):
+        return ut.aggregate_cube(cube_filtered, ['artist', 'explicit'], ['popularity'])
+
+
+# Mean audio features over every track of an artist (NaN for an unknown artist)
+def artist_feature_means(artist):
+    with metrics.phase('aggregate'):
+        return data.artist_feature_df.reindex([artist]).iloc[0]
+
+
+# Number of artists returned per dropdown search
+SEARCH_RESULT_LIMIT = 20
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _genre_artists(version, genres, start_year, end_year):
+    return frozenset(ut.filter_genre_artists(data.genre_index, genres, start_year, end_year))
+
+
+# Artists of the given genres and year range, cached per query since they are the same
+# for every user
+def genre_artists(selected_genres, start_year, end_year):
+    if isinstance(selected_genres, str):
+        selected_genres = [selected_genres]
+    with metrics.phase('filter'):
+        return _genre_artists(data.version, tuple(sorted(set(selected_genres))), int(start_year), int(end_year))
+
+
+# Dropdown options for the most popular artists matching search_value. The selected
+# artists always come first so the dropdown keeps displaying them.
+def search_artist_options(search_value, selected_artists=(), allowed=None):
+    artists = list(selected_artists)
+    with metrics.phase('filter'):
+        matches = ut.search_artists(data.artist_search_index, search_value, SEARCH_RESULT_LIMIT + len(artists),
+                                    allowed)
+    for artist in matches:
+        if artist not in artists and len(artists) < SEARCH_RESULT_LIMIT + len(selected_artists):
+            artists.append(artist)
+    return [{'label': artist, 'value': artist} for artist in artists]
+
+
+# Called with no arguments after every reload, e.g. to drop other caches built from the old data
+reload_listeners = []
+_reload_lock = threading.Lock()
+_reloader_pid = None
+
+
+# Swap in a bundle built from the data files if they changed since the current one was
+# loaded, returning whether it did. Cached query results of the old bundle are dropped.
+def reload_data():
+    global data
+    with _reload_lock:
+        if current_version() == data.version:
+            return False
+        data = load_data(data)
+        _query_tracks.cache_clear()
+        _genre_artists.cache_clear()
+        for listener in reload_listeners:
+            listener()
+        return True
+
+
+# Check the data files every RELOAD_INTERVAL seconds from a background thread of this
+# process. Threads do not survive a fork, so every gunicorn worker starts its own; calls
+# after the first in a process do nothing.
+def start_reloader():
+    global _reloader_pid
+    if RELOAD_INTERVAL <= 0 or _reloader_pid == os.getpid():
+        return
+    _reloader_pid = os.getpid()
+    threading.Thread(target=_watch_data, name='data-reloader', daemon=True).start()
+
+
+def _watch_data():
+    while True:
+        time.sleep(RELOAD_INTERVAL)
+        try:
+            reload_data()
+        except Exception:
+            # Keep serving the current data, e.g. when the files are caught mid-write
+            traceback.print_exc()
+
+
+# Configuration. The genre and year dropdowns are built per page load from the current data.
+def create_genre_dropdown():
+    return dcc.Dropdown(
+        options=data.genre_dropdown_options,
+        value="pop",
+        multi=False,
+        placeholder='Select a genre...',
+        id='genre-dropdown'
+    )
+
+
+# Filled in by the update_artist_dropdown callback for the selected genre, years and search
 artist_dropdown = dcc.Dropdown(
-    options=tracks_df['artist'].unique(),
+    options=[],
     value=['Taylor Swift', 'Ed Sheeran', 'The Weeknd', 'Justin Bieber'],
     multi=True,
     placeholder='Select multiple artists...',
     id='artists-dropdown'
 )
-year_range_selector = dbc.Row([
-    dbc.Col(
-        dcc.Dropdown(
-            options=sorted(tracks_df['release_year'].unique()),
-            value=2010,
-            multi=False,
-            placeholder='Select the start year...',
-            id='start-year'
-        )),
-    dbc.Col(
-        dcc.Dropdown(
-            options=sorted(tracks_df['release_year'].unique()),
-            value=2021,
-            multi=False,
-            placeholder='Select the end year...',
-            id='end-year'
-        ))
-])
 
+
+def create_year_range_selector():
+    return dbc.Row([
+        dbc.Col(
+            dcc.Dropdown(
+                options=data.release_years,
+                value=2010,
+                multi=False,
+                placeholder='Select the start year...',
+                id='start-year'
+            )),
+        dbc.Col(
+            dcc.Dropdown(
+                options=data.release_years,
+                value=2021,
+                multi=False,
+                placeholder='Select the end year...',
+                id='end-year'
+            )),
+        # Sorted release years, from which the year options are filtered in the browser
+        dcc.Store(id='year-domain', data=data.release_years)
+    ])
+
+
+# Options are searched on the server as the user types, see search_compare_artist
 optional_artist_selector_dropdown = dcc.Dropdown(
-    options=tracks_df['artist'].unique(),
+    options=[],
     multi=False,
     placeholder='Select an artist you want to compare...',
     id='artists-dropdown-compare'
 )
 
+
 submit_button = dbc.Button('Plot!', id='submit-button', style={'background-color': '#196543'})
 
 # artist_time_chart = dvc.Vega(id='artist-time-chart', spec={}, opt={'actions': False})
@@ -55,34 +256,36 @@ submit_button = dbc.Button('Plot!', id='submit-button', style={'background-color
 # top5songs_barchart = dvc.Vega(id='top5songs-barchart', spec={}, opt={'actions': False})
 # speechiness_chart = dvc.Vega(id='speechiness-chart', spec={}, opt={'actions': False})
 
+# Title and tooltip of the mean card shown for each audio feature, in display order
+FEATURE_CARDS = [
+    ('danceability', 'Danceability', "Danceability describes how suitable a track is for dancing based on a combination of musical elements including tempo, rhythm stability, beat strength, and overall regularity. A value of 0.0 is least danceable and 1.0 is most danceable"),
+    ('energy', 'Energy', "Energy is a measure from 0.0 to 1.0 and represents a perceptual measure of intensity and activity. Typically, energetic tracks feel fast, loud, and noisy."),
+    ('loudness', 'Loudness', "The overall loudness of a track in decibels (dB)"),
+    ('speechiness', 'Speechiness', "Speechiness detects the presence of spoken words in a track. The more exclusively speech-like the recording (e.g. talk show, audio book, poetry), the closer to 1.0 the attribute value."),
+    ('acousticness', 'Acousticness', "A confidence measure from 0.0 to 1.0 of whether the track is acoustic. 1.0 represents high confidence the track is acoustic."),
+    ('instrumentalness', 'Instrumentalness', "Predicts whether a track contains no vocals. \"Ooh\" and \"aah\" sounds are treated as instrumental in this context. Rap or spoken word tracks are clearly \"vocal\". The closer the instrumentalness value is to 1.0, the greater likelihood the track contains no vocal content."),
+    ('liveness', 'Liveness', "Detects the presence of an audience in the recording. Higher liveness values represent an increased probability that the track was performed live. A value above 0.8 provides strong likelihood that the track is live."),
+    ('valence', 'Valence', "A measure from 0.0 to 1.0 describing the musical positiveness conveyed by a track. Tracks with high valence sound more positive (e.g. happy, cheerful, euphoric), while tracks with low valence sound more negative (e.g. sad, depressed, angry)."),
+]
+
+
+# Content of the mean card of one feature
+def feature_card(feature, title, tooltip, text):
+    return dbc.Card([
+        dbc.CardHeader(title, style={"color": "#1db954"}, className='text-center'),
+        dbc.Tooltip(tooltip, target=f"tooltip-target-{feature}", placement="left", style={"padding": "2px"}),
+        dbc.CardBody(text, className='text-center', style={'padding': '10px'})
+    ], id=f"tooltip-target-{feature}")
+
+
 summary_statistics = dbc.Col([
     html.Br(),
     html.H4('Song features (Mean)', className='text-center', style={"color": 'white'}),
     html.H5('Top 5 Popular Songs', id='top-five-title', className='text-center', style={"color": 'white'}),
-    dbc.Row([
-        dbc.Card(id='mean-danceability', style={"border": 0, "width": "75%"},className="mb-2 mx-auto", outline=True,),
-]),
+] + [
     dbc.Row(
-        dbc.Card(id='mean-energy', style={"border": 0, "width": "75%" }, className="mb-2 mx-auto", outline=True)
-    ),
-    dbc.Row(
-        dbc.Card(id='mean-loudness', style={"border": 0,"width": "75%"}, className="mb-2 mx-auto", outline=True)
-    ),
-    dbc.Row(
-        dbc.Card(id='mean-speechiness', style={"border": 0,"width": "75%"}, className="mb-2 mx-auto", outline=True)
-    ),
-    dbc.Row(
-        dbc.Card(id='mean-acousticness', style={"border": 0,"width": "75%"}, className="mb-2 mx-auto", outline=True)
-    ),
-    dbc.Row(
-        dbc.Card(id='mean-instrumentalness', style={"border": 0,"width": "75%"}, className="mb-2 mx-auto", outline=True)
-    ),
-    dbc.Row(
-        dbc.Card(id='mean-liveness', style={"border": 0,"width": "75%"}, className="mb-2 mx-auto", outline=True)
-    ),
-    dbc.Row(
-        dbc.Card(id='mean-valence', style={"border": 0,"width": "75%"},className="mb-2 mx-auto", outline=True)
-    )
+        dbc.Card(id=f'mean-{feature}', style={"border": 0, "width": "75%"}, className="mb-2 mx-auto", outline=True)
+    ) for feature, _, _ in FEATURE_CARDS
 ])
 
 milestone_blurb=[
@@ -0,0 +1,73 @@
+import fcntl
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from dash import DiskcacheManager
+
+# Set SPOTIFY_BACKGROUND_JOBS to the number of "Plot!" submissions computed at once on this
+# machine to run them as Dash background callbacks: each one in its own process, out of the
+# gunicorn workers, and killed when the same browser submits again or changes the selection.
+BACKGROUND_JOBS = int(os.environ.get('SPOTIFY_BACKGROUND_JOBS', 0))
+# Results, progress and job slots shared by every worker of the machine
+JOB_DIR = os.environ.get('SPOTIFY_JOB_DIR', os.path.join(tempfile.gettempdir(), 'spotify-dashboard-jobs'))
+# Milliseconds between two polls of the browser for the result of a job
+POLL_INTERVAL = 250
+
+
+# Hold one of slots lock files in directory while running, waiting for one to be free. The
+# locks are released by the kernel when the process dies, so killed jobs never leak a slot.
+@contextmanager
+def job_slot(directory, slots, wait=0.05):
+    os.makedirs(directory, exist_ok=True)
+    while True:
+        for slot in range(slots):
+            file = open(os.path.join(directory, f'slot-{slot}.lock'), 'w')
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                continue
+            try:
+                yield slot
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+                file.close()
+            return
+        time.sleep(wait)
+
+
+# DiskcacheManager running at most slots jobs at once; the processes of the others wait for a
+# free slot (and can be cancelled while they do) instead of competing for the CPU
+class BoundedDiskcacheManager(DiskcacheManager):
+    def __init__(self, cache, slots, **kwargs):
+        super().__init__(cache, **kwargs)
+        self.slots = slots
+        self.slot_dir = os.path.join(cache.directory, 'slots')
+
+    def make_job_fn(self, fn, progress, key=None):
+        job_fn = super().make_job_fn(fn, progress, key)
+
+        def bounded_job_fn(*args):
+            with job_slot(self.slot_dir, self.slots):
+                job_fn(*args)
+
+        return bounded_job_fn
+
+    # A finished job is left as a zombie until the worker that started it reaps it. Killing it
+    # from another worker would wait a second for a process that is already gone.
+    def terminate_job(self, job):
+        if job is not None and self.job_running(job):
+            super().terminate_job(job)
+
+
+# The background callback manager for SPOTIFY_BACKGROUND_JOBS, or None when it is not set
+def create_manager():
+    if BACKGROUND_JOBS <= 0:
+        return None
+    try:
+        import diskcache
+    except ImportError as error:
+        raise ImportError('SPOTIFY_BACKGROUND_JOBS needs the diskcache, multiprocess and psutil packages '
+                          '(pip install "dash[diskcache]")') from error
+    return BoundedDiskcacheManager(diskcache.Cache(os.path.join(JOB_DIR, 'results')), BACKGROUND_JOBS)
@@ -0,0 +1,136 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import flask
+
+# Set SPOTIFY_METRICS=1 to time the callbacks. When it is off timed_callback returns the
+# callback unchanged and phase returns a shared no-op context manager.
+ENABLED = os.environ.get('SPOTIFY_METRICS') == '1'
+# Phases reported for every callback; 'total' is the wall time of the callback itself
+PHASES = ['filter', 'aggregate', 'build', 'serialize']
+
+_current_timings = contextvars.ContextVar('callback_timings', default=None)
+_no_phase = nullcontext()
+_lock = threading.Lock()
+# Cumulative seconds and number of timed calls per (callback, phase) since the worker started
+_seconds = defaultdict(float)
+_counts = defaultdict(int)
+# Cumulative response bytes per callback, before and after compression, and responses sent
+_payload_bytes = defaultdict(int)
+_wire_bytes = defaultdict(int)
+_responses = defaultdict(int)
+
+
+# Seconds spent in each phase by one callback call, added to by every thread it runs on
+class CallbackTimings:
+    def __init__(self, callback):
+        self.callback = callback
+        self.phases = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] += seconds
+
+
+# Context manager timing a phase of the callback being run, e.g. with metrics.phase('filter')
+def phase(name):
+    if not ENABLED:
+        return _no_phase
+    return _timed_phase(name)
+
+
+@contextmanager
+def _timed_phase(name):
+    timings = _current_timings.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.add(name, time.perf_counter() - start)
+
+
+# Decorator applied below @app.callback that records the phases of every call
+def timed_callback(func):
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = CallbackTimings(func.__name__)
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.add('total', time.perf_counter() - start)
+            _current_timings.reset(token)
+            with _lock:
+                for name, seconds in timings.phases.items():
+                    _seconds[func.__name__, name] += seconds
+                    _counts[func.__name__, name] += 1
+            if flask.has_request_context():
+                flask.g.callback_timings = timings
+
+    return wrapper
+
+
+# Record the size of a callback response as serialized and as sent over the wire
+def record_response(callback, payload_bytes, wire_bytes):
+    with _lock:
+        _payload_bytes[callback] += payload_bytes
+        _wire_bytes[callback] += wire_bytes
+        _responses[callback] += 1
+
+
+# Server-Timing header value of a callback call, in milliseconds
+def server_timing(timings):
+    phases = [name for name in PHASES if name in timings.phases] + ['total']
+    return ', '.join(f'{name};dur={timings.phases[name] * 1000:.1f}' for name in phases)
+
+
+# Metrics in the Prometheus text exposition format
+def prometheus_text():
+    with _lock:
+        samples = sorted(_seconds.items())
+        counts = dict(_counts)
+    lines = ['# HELP spotify_callback_phase_seconds Time spent in each phase of the dashboard callbacks.',
+             '# TYPE spotify_callback_phase_seconds summary']
+    for (callback, name), seconds in samples:
+        labels = f'callback="{callback}",phase="{name}"'
+        lines.append(f'spotify_callback_phase_seconds_sum{{{labels}}} {seconds:.6f}')
+        lines.append(f'spotify_callback_phase_seconds_count{{{labels}}} {counts[callback, name]}')
+    with _lock:
+        responses = sorted(_responses.items())
+        payload_bytes = dict(_payload_bytes)
+        wire_bytes = dict(_wire_bytes)
+    for metric, help_text, sizes in [
+            ('spotify_callback_payload_bytes', 'Size of the serialized callback responses.', payload_bytes),
+            ('spotify_callback_wire_bytes', 'Size of the callback responses as sent, after compression.', wire_bytes)]:
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} summary']
+        for callback, count in responses:
+            lines.append(f'{metric}_sum{{callback="{callback}"}} {sizes[callback]}')
+            lines.append(f'{metric}_count{{callback="{callback}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+# Serve /metrics and add a Server-Timing header to the responses of timed callbacks
+def init_app(server):
+    if not ENABLED:
+        return
+
+    @server.route('/metrics')
+    def metrics():
+        return flask.Response(prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+    @server.after_request
+    def add_server_timing(response):
+        timings = flask.g.pop('callback_timings', None)
+        if timings is not None:
+            response.headers['Server-Timing'] = server_timing(timings)
+        return response
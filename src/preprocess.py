@@ -0,0 +1,123 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pandas as pd
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+import src.utils as ut
+
+# Integer columns, cast explicitly so that every chunk is written with the same types
+INTEGER_COLUMNS = ['popularity', 'duration_ms', 'explicit', 'release_year', 'speechiness_binned']
+# Schema of every file written. Inferred from each year's tracks instead, a year whose tracks all
+# have empty genre lists would store genres as list<null>, which the other years cannot be cast to.
+TRACKS_SCHEMA = pa.schema(
+    [('name', pa.string()), ('artist', pa.string()), ('genres', pa.list_(pa.string()))]
+    + [(column, pa.int64()) for column in INTEGER_COLUMNS if column != 'speechiness_binned']
+    + [(column, pa.float64()) for column in ['danceability', 'energy', 'speechiness', 'acousticness',
+                                             'instrumentalness', 'liveness', 'valence', 'loudness', 'tempo']]
+    + [('speechiness_binned', pa.int64())])
+
+
+# Bring a chunk of the tracks csv into the processed layout: genres as a list column and
+# release_year derived when the csv only has release_date. speechiness_binned is not derived:
+# the csv has to carry it, as data/processed/tracks_processed.csv does.
+def process_chunk(chunk):
+    if 'speechiness_binned' not in chunk:
+        raise ValueError('the tracks csv has no speechiness_binned column')
+    chunk['genres'] = ut.parse_genres(chunk['genres'])
+    if 'release_year' not in chunk:
+        chunk['release_year'] = pd.to_datetime(chunk['release_date'], format='mixed').dt.year
+    for column in INTEGER_COLUMNS:
+        if column in chunk:
+            chunk[column] = chunk[column].astype('int64')
+    return chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the processed tracks csv into the parquet files '
+                                                 'read by the dashboard, streaming it in chunks.')
+    parser.add_argument('--input', default='data/processed/tracks_processed.csv',
+                        help='processed tracks csv')
+    parser.add_argument('--output-dir', default=ut.DATA_DIR,
+                        help='directory receiving tracks_processed.parquet, tracks_cube.parquet and the '
+                             'tracks_dataset directory')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='csv rows held in memory at a time')
+    parser.add_argument('--row-group-size', type=int, default=2048,
+                        help='rows per parquet row group; smaller groups let readers skip more data')
+    parser.add_argument('--append', action='store_true',
+                        help='add the csv tracks to the existing tracks_dataset as new files and to '
+                             'tracks_cube.parquet, leaving tracks_processed.parquet as it is; a dashboard '
+                             'in dataset mode picks them up without rereading the rest, while the '
+                             'in-memory mode keeps serving tracks_processed.parquet')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    dataset_path = os.path.join(args.output_dir, os.path.basename(ut.TRACKS_DATASET_PATH))
+    with tempfile.TemporaryDirectory(dir=args.output_dir) as work_dir:
+        # First pass: spill every chunk into one file per release year, summing the cube as we go
+        staging_dir = os.path.join(work_dir, 'staging')
+        cube_parts = []
+        for number, chunk in enumerate(pd.read_csv(args.input, chunksize=args.chunk_size)):
+            chunk = process_chunk(chunk)
+            cube_parts.append(ut.create_track_cube(chunk))
+            for year, year_df in chunk.groupby('release_year'):
+                year_dir = os.path.join(staging_dir, str(year))
+                os.makedirs(year_dir, exist_ok=True)
+                pq.write_table(pa.Table.from_pandas(year_df, schema=TRACKS_SCHEMA, preserve_index=False),
+                               os.path.join(year_dir, f'chunk-{number}.parquet'))
+
+        # Second pass, one release year in memory at a time: sort it by artist and write it to
+        # its hive partition of the dataset and to the single file read by the in-memory loader
+        new_dataset_path = dataset_path if args.append else os.path.join(work_dir, 'tracks_dataset')
+        tracks_path = os.path.join(work_dir, 'tracks_processed.parquet')
+        part_name = f'part-{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}.parquet' if args.append \
+            else 'part-0.parquet'
+        cube_path = os.path.join(work_dir, 'tracks_cube.parquet')
+        if args.append:
+            # The cube is updated before the new files appear, as they are picked up on their own
+            cube_parts.append(pd.read_parquet(os.path.join(args.output_dir, 'tracks_cube.parquet')))
+            pq.write_table(pa.Table.from_pandas(ut.merge_track_cubes(cube_parts), preserve_index=False), cube_path)
+            os.replace(cube_path, os.path.join(args.output_dir, 'tracks_cube.parquet'))
+        writer = None
+        for year in sorted(os.listdir(staging_dir), key=int):
+            year_dir = os.path.join(staging_dir, year)
+            table = pa.concat_tables([pq.read_table(os.path.join(year_dir, name)) for name in os.listdir(year_dir)])
+            table = table.sort_by([('artist', 'ascending')])
+            if not args.append:
+                if writer is None:
+                    writer = pq.ParquetWriter(tracks_path, table.schema)
+                writer.write_table(table, row_group_size=args.row_group_size)
+
+            partition_dir = os.path.join(new_dataset_path, f'release_year={year}')
+            os.makedirs(partition_dir, exist_ok=True)
+            # Written next to the staging files and renamed, so readers never see a partial file
+            part_path = os.path.join(year_dir, part_name)
+            pq.write_table(table.drop_columns(['release_year']), part_path,
+                           row_group_size=args.row_group_size, write_statistics=True)
+            os.replace(part_path, os.path.join(partition_dir, part_name))
+            shutil.rmtree(year_dir)
+        if writer is not None:
+            writer.close()
+        if args.append:
+            return
+
+        # Artist x release year x explicit aggregates served to the charts
+        pq.write_table(pa.Table.from_pandas(ut.merge_track_cubes(cube_parts), preserve_index=False), cube_path)
+
+        # Move the outputs into place only once all of them are complete. The cube goes first,
+        # so a running dashboard reloading on the change of the tracks finds the matching cube.
+        # The previous dataset is deleted with work_dir: a dashboard in dataset mode that does
+        # not reload has to be restarted.
+        os.replace(cube_path, os.path.join(args.output_dir, 'tracks_cube.parquet'))
+        if os.path.exists(dataset_path):
+            os.replace(dataset_path, os.path.join(work_dir, 'previous_dataset'))
+        os.replace(new_dataset_path, dataset_path)
+        os.replace(tracks_path, os.path.join(args.output_dir, 'tracks_processed.parquet'))
+
+if __name__ == '__main__':
+    main()
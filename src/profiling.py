@@ -0,0 +1,705 @@
+import argparse
+import gzip
+import http.client
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+# Third-party packages imported by the dashboard, timed as the "imports" startup phase
+STARTUP_IMPORTS = ['pandas', 'pyarrow', 'dash', 'dash_bootstrap_components', 'dash_vega_components']
+
+
+def spec_size(args):
+    import src.components as cmp
+    import src.charts as charts
+
+    artists = args.artists or artist_track_counts(cmp.data.cube_df).index[:5].tolist()
+    start_year = args.start_year or cmp.data.release_years[0]
+    end_year = args.end_year or cmp.data.release_years[-1]
+    tracks_df_filtered = cmp.query_tracks(artists, start_year, end_year)
+
+    print(f"artists: {', '.join(artists)} ({start_year}-{end_year}, {len(tracks_df_filtered)} tracks)")
+    for label, server_side in [('client-side (raw rows)', False), ('server-side', True)]:
+        spec = charts.speechiness_chart(tracks_df_filtered, start_year, end_year, server_side=server_side,
+                                        row_cap=args.row_cap)
+        print(f"speechiness chart, {label}: {len(json.dumps(spec)):,} bytes")
+
+
+# Number of tracks of each artist, most prolific first, from the track cube of any data mode
+def artist_track_counts(cube_df):
+    return cube_df.groupby('artist', observed=True)['count'].sum().sort_values(ascending=False, kind='stable')
+
+
+def current_rss():
+    # Resident set size of this process in bytes
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def memory(args):
+    import src.utils as ut
+
+    args.path = args.path or ut.TRACKS_PATH
+    if args.loader is None:
+        # Measure each loader in a fresh interpreter so they do not share allocations
+        for loader in ['plain', 'optimized']:
+            subprocess.run([sys.executable, __file__, 'memory', '--path', args.path, '--loader', loader], check=True)
+        return
+
+    import pandas as pd
+
+    rss_before = current_rss()
+    if args.loader == 'plain':
+        tracks_df = pd.read_parquet(args.path)
+    else:
+        tracks_df = ut.load_tracks(args.path)
+    rss_after = current_rss()
+    print(f"{args.loader:>9} loader: RSS +{(rss_after - rss_before) / 2 ** 20:,.1f} MiB, "
+          f"DataFrame {tracks_df.memory_usage(deep=True).sum() / 2 ** 20:,.1f} MiB "
+          f"({len(tracks_df):,} rows x {tracks_df.shape[1]} columns)")
+
+
+def genres(args):
+    import pandas as pd
+    import src.utils as ut
+
+    args.path = args.path or ut.TRACKS_PATH
+
+    genres_strings = pd.read_parquet(args.path, columns=['genres'])['genres']
+    if len(genres_strings) and not isinstance(genres_strings.iloc[0], str):
+        # Newer files store genres as a list column; restore the stringified form to parse
+        genres_strings = genres_strings.map(lambda genres_list: str(list(genres_list)))
+    if args.rows:
+        genres_strings = genres_strings.iloc[:args.rows]
+    print(f"parsing {len(genres_strings):,} genre strings")
+
+    timings = {}
+    try:
+        import joblib
+    except ImportError:
+        print("joblib is not installed, skipping the previous disk-cached path")
+    else:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cached_convert = joblib.Memory(cache_dir, verbose=0).cache(ut.convert_string_to_list)
+            for label in ['joblib disk cache, cold', 'joblib disk cache, warm']:
+                start = time.perf_counter()
+                genres_strings.apply(cached_convert)
+                timings[label] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    genres_strings.apply(ut.convert_string_to_list)
+    timings['per-row literal_eval'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ut.parse_genres(genres_strings)
+    timings['utils.parse_genres'] = time.perf_counter() - start
+
+    for label, seconds in timings.items():
+        print(f"{label:>24}: {seconds:8.3f}s")
+
+
+def startup(args):
+    if not args.child:
+        # Time a cold start in a fresh interpreter
+        child = subprocess.run([sys.executable, __file__, 'startup', '--child'], check=True,
+                               stdout=subprocess.PIPE, text=True)
+        timings = json.loads(child.stdout.strip().splitlines()[-1])
+        total = timings.pop('total')
+        for phase, seconds in timings.items():
+            print(f"{phase:>20}: {seconds:7.3f}s")
+        print(f"{'other':>20}: {total - sum(timings.values()):7.3f}s")
+        print(f"{'total':>20}: {total:7.3f}s")
+        if args.budget is not None and total > args.budget:
+            sys.exit(f"cold start took {total:.3f}s, over the {args.budget:.3f}s budget")
+        return
+
+    import importlib
+
+    start = time.perf_counter()
+    for module in STARTUP_IMPORTS:
+        importlib.import_module(module)
+    imports = time.perf_counter() - start
+    import src.utils as ut
+    ut.STARTUP_TIMINGS['imports'] = imports
+    importlib.import_module('src.app')
+    print(json.dumps(dict(ut.STARTUP_TIMINGS, total=time.perf_counter() - start)))
+
+
+# Copy of tracks_df with every track repeated scale times. The copies keep their artist so
+# that per-artist queries grow with the scale, and their popularity and audio features are
+# jittered so that top-k and regression results stay realistic.
+def synthesize_tracks(tracks_df, scale, seed=0):
+    import numpy as np
+    import pandas as pd
+    import src.utils as ut
+
+    if scale == 1:
+        return tracks_df
+    rng = np.random.default_rng(seed)
+    synthetic_df = pd.concat([tracks_df] * scale, ignore_index=True)
+    copy = np.repeat(np.arange(scale), len(tracks_df))
+    jitter = copy > 0
+    synthetic_df['popularity'] = np.where(
+        jitter, np.clip(synthetic_df['popularity'] + rng.integers(-5, 6, len(synthetic_df)), 0, 100),
+        synthetic_df['popularity'])
+    for feature in ut.AUDIO_FEATURES:
+        values = synthetic_df[feature].to_numpy(dtype='float64')
+        noisy = values + rng.normal(0, 0.02 if feature != 'loudness' else 0.5, len(values))
+        if feature != 'loudness':
+            noisy = np.clip(noisy, 0, 1)
+        synthetic_df[feature] = np.where(jitter, noisy, values)
+    return synthetic_df
+
+
+# Callback arguments of a representative and a worst-case submission (biggest genre, five
+# most prolific artists, every release year) for the loaded data
+def benchmark_inputs(cmp):
+    artist_counts = artist_track_counts(cmp.data.cube_df)
+    genre_counts = cmp.data.track_store.genre_counts()
+    first_year = cmp.data.release_years[0]
+    last_year = cmp.data.release_years[-1]
+    # artists just inside the top percentile and the median genre stand in for a typical query
+    typical_artists = artist_counts.index[len(artist_counts) // 100:][:2].tolist()
+    prolific_artists = artist_counts.index[:6].tolist()
+    return {
+        'render_dashboard': {
+            'typical': (1, typical_artists, last_year - 10, last_year, None),
+            'worst': (1, prolific_artists[:5], first_year, last_year, prolific_artists[5])
+        },
+        'update_artist_dropdown': {
+            'typical': ([genre_counts.index[len(genre_counts) // 2]], last_year - 10, last_year, typical_artists[0][:2], []),
+            'worst': ([genre_counts.index[0]], first_year, last_year, '', [])
+        },
+        'search_compare_artist': {
+            'typical': (typical_artists[0][:2], None),
+            'worst': (prolific_artists[0][:1], prolific_artists[0])
+        }
+    }
+
+
+def benchmark(args):
+    if not args.child and not args.generate:
+        # Run each scale in a fresh interpreter so that loaded data and caches do not carry over
+        results = []
+        for scale in args.scales:
+            with tempfile.TemporaryDirectory() as data_dir:
+                env = dict(os.environ, SPOTIFY_SPEC_CACHE_BACKEND='')
+                if scale != 1:
+                    subprocess.run([sys.executable, __file__, 'benchmark', '--generate', data_dir,
+                                    '--scales', str(scale)], check=True)
+                    env['SPOTIFY_DATA_DIR'] = data_dir
+                child = subprocess.run([sys.executable, __file__, 'benchmark', '--child', '--scales', str(scale),
+                                        '--repeat', str(args.repeat)], env=env, check=True,
+                                       stdout=subprocess.PIPE, text=True)
+            results += json.loads(child.stdout.strip().splitlines()[-1])
+
+        print(f"{'scale':>5} {'callback':<40} {'case':<8} {'cold ms':>9} {'warm ms':>9} {'peak MiB':>9} "
+              f"{'bytes':>10} {'wire':>9}")
+        for result in results:
+            print(f"{result['scale']:>4}x {result['callback']:<40} {result['case']:<8} {result['cold_ms']:9.1f} "
+                  f"{result['warm_ms']:9.1f} {result['peak_mib']:9.1f} {result['bytes']:10,} "
+                  f"{result['wire_bytes']:9,}")
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(results, file, indent=2)
+        return
+
+    if args.generate:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import src.utils as ut
+
+        tracks_df = synthesize_tracks(ut.load_tracks(ut.TRACKS_PATH), args.scales[0])
+        tracks_df['artist'] = tracks_df['artist'].astype(str)
+        pq.write_table(pa.Table.from_pandas(tracks_df, preserve_index=False),
+                       os.path.join(args.generate, 'tracks_processed.parquet'))
+        pq.write_table(pa.Table.from_pandas(ut.create_track_cube(tracks_df), preserve_index=False),
+                       os.path.join(args.generate, 'tracks_cube.parquet'))
+        return
+
+    import src.app
+    import src.charts as charts
+    import src.components as cmp
+    import src.tracks as trk
+    import src.transport as transport
+
+    def clear_caches():
+        cmp._query_tracks.cache_clear()
+        cmp._genre_artists.cache_clear()
+        if isinstance(cmp.data.track_store, trk.DatasetTracks):
+            cmp.data.track_store._query.cache_clear()
+        charts.spec_cache.clear()
+
+    callbacks = [getattr(entry['callback'], '__wrapped__', entry['callback'])
+                 for entry in src.app.app.callback_map.values() if 'callback' in entry]
+    inputs = benchmark_inputs(cmp)
+    results = []
+    for func in callbacks:
+        for case, func_args in inputs.get(func.__name__, {}).items():
+            cold_times = []
+            for _ in range(args.repeat):
+                clear_caches()
+                start = time.perf_counter()
+                response = func(*func_args)
+                cold_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            func(*func_args)
+            warm_time = time.perf_counter() - start
+
+            clear_caches()
+            tracemalloc.start()
+            func(*func_args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            body = transport.to_json(response).encode()
+            compressed = transport.compress(body, {'br': 1, 'gzip': 1})
+            results.append({'scale': args.scales[0], 'callback': func.__name__, 'case': case,
+                            'cold_ms': statistics.median(cold_times) * 1000, 'warm_ms': warm_time * 1000,
+                            'peak_mib': peak / 2 ** 20, 'bytes': len(body),
+                            'wire_bytes': len(compressed[0]) if len(body) >= transport.COMPRESS_MIN_BYTES > 0
+                            else len(body)})
+    print(json.dumps(results))
+
+
+# Chart specs of the dashboard built with Altair and with the templates of specs.py, which
+# must be identical, and the time each builder adds to a "Plot!" submission
+def specs(args):
+    import src.app
+    import src.charts as charts
+    import src.components as cmp
+
+    render_dashboard = getattr(src.app.render_dashboard, '__wrapped__', src.app.render_dashboard)
+    cases = dict(benchmark_inputs(cmp)['render_dashboard'])
+    artists = list(artist_track_counts(cmp.data.cube_df).index)
+    years = cmp.data.release_years
+    rng = random.Random(args.seed)
+    for number in range(args.samples):
+        start_year = rng.choice(years)
+        cases[f'random {number}'] = (1, rng.sample(artists, rng.randint(1, 5)), start_year,
+                                     rng.choice([year for year in years if year >= start_year]),
+                                     rng.choice([None, rng.choice(artists)]))
+
+    mismatches = []
+    print(f"{'case':<12} {'altair ms':>10} {'template ms':>12} {'speedup':>8}")
+    for case, func_args in cases.items():
+        timings = {}
+        outputs = {}
+        for builder in ['altair', 'template']:
+            charts.SPEC_BUILDER = builder
+            times = []
+            for _ in range(args.repeat if not case.startswith('random') else 1):
+                charts.spec_cache.clear(backend=False)
+                start = time.perf_counter()
+                outputs[builder] = render_dashboard(*func_args)[-4:]
+                times.append(time.perf_counter() - start)
+            timings[builder] = statistics.median(times)
+        if json.dumps(outputs['altair']) != json.dumps(outputs['template']):
+            mismatches.append(case)
+        if not case.startswith('random'):
+            print(f"{case:<12} {timings['altair'] * 1000:10.1f} {timings['template'] * 1000:12.1f} "
+                  f"{timings['altair'] / timings['template']:7.1f}x")
+    print(f"{len(cases) - len(mismatches)} of {len(cases)} submissions gave identical specs")
+    if mismatches:
+        sys.exit(f"specs differ for: {', '.join(mismatches)}")
+
+
+# Talks to a running dashboard the way the browser does: the callbacks come from
+# /_dash-dependencies and every update is a POST to /_dash-update-component
+class DashClient:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.callbacks = {callback['output']: callback for callback in self.request('GET', '/_dash-dependencies')}
+
+    def request(self, method, path, payload=None):
+        # sync gunicorn workers close the connection after every response anyway
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=300)
+        try:
+            headers = {'Accept-Encoding': 'gzip'}
+            if payload is not None:
+                headers['Content-Type'] = 'application/json'
+            connection.request(method, path, json.dumps(payload) if payload is not None else None, headers)
+            response = connection.getresponse()
+            body = response.read()
+        finally:
+            connection.close()
+        if response.status == 204:
+            return None
+        if response.status != 200:
+            raise RuntimeError(f"{method} {path}: HTTP {response.status}")
+        if response.getheader('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body)
+
+    # Response of the server callback writing output, given the values of its inputs and state
+    # by "id.property", and the number of requests it took; changed lists the properties the
+    # user changed
+    def update(self, output, values, changed):
+        callback = self.callbacks[output]
+        outputs = [dict(zip(['id', 'property'], name.rsplit('.', 1))) for name in output.strip('.').split('...')]
+        payload = {
+            'output': output,
+            'outputs': outputs if output.startswith('..') else outputs[0],
+            'inputs': [dict(item, value=values.get(f"{item['id']}.{item['property']}")) for item in callback['inputs']],
+            'state': [dict(item, value=values.get(f"{item['id']}.{item['property']}")) for item in callback['state']],
+            'changedPropIds': changed
+        }
+        response = self.request('POST', '/_dash-update-component', payload)
+        requests = 1
+        if response is not None and 'cacheKey' in response:
+            # A background callback: poll for the result of the job like the browser does
+            query = urllib.parse.urlencode({'cacheKey': response['cacheKey'], 'job': response['job']})
+            interval = (callback.get('long') or {}).get('interval', 1000) / 1000
+            while response is not None and 'response' not in response:
+                time.sleep(interval)
+                response = self.request('POST', f'/_dash-update-component?{query}', payload)
+                requests += 1
+        return response, requests
+
+    # Responses of every server callback the change of the "id.property" input triggers, by
+    # output, and the number of requests they took. Like the browser, the callbacks are called
+    # at once, over at most BROWSER_CONNECTIONS connections.
+    def change(self, input_name, values):
+        outputs = [output for output, callback in self.callbacks.items()
+                   if not callback.get('clientside_function')
+                   and input_name in [f"{item['id']}.{item['property']}" for item in callback['inputs']]]
+        if len(outputs) == 1:
+            response, requests = self.update(outputs[0], values, [input_name])
+            return {outputs[0]: response}, requests
+        with ThreadPoolExecutor(max_workers=BROWSER_CONNECTIONS) as executor:
+            results = list(executor.map(lambda output: self.update(output, values, [input_name]), outputs))
+        return ({output: response for output, (response, _) in zip(outputs, results)},
+                sum(requests for _, requests in results))
+
+
+# props of the component with the given id in a Dash layout
+def find_component(layout, component_id):
+    if isinstance(layout, dict):
+        if layout.get('props', {}).get('id') == component_id:
+            return layout['props']
+        children = layout.values()
+    elif isinstance(layout, list):
+        children = layout
+    else:
+        return None
+    for child in children:
+        props = find_component(child, component_id)
+        if props is not None:
+            return props
+    return None
+
+
+def dropdown_values(options):
+    return [option['value'] if isinstance(option, dict) else option for option in options]
+
+
+# options of a dropdown in the responses of DashClient.change
+def option_values(responses, component_id):
+    for response in responses.values():
+        if response and component_id in response['response'] and 'options' in response['response'][component_id]:
+            return dropdown_values(response['response'][component_id]['options'])
+    return []
+
+
+# Steps of a load test session, in order, and the input the user changes in each
+LOADTEST_STEPS = {
+    'genre change': 'genre-dropdown.value',
+    'year change': 'start-year.value',
+    'plot': 'submit-button.n_clicks',
+    'compare search': 'artists-dropdown-compare.search_value',
+    'plot + compare': 'submit-button.n_clicks'
+}
+# Connections a browser opens to one server at most
+BROWSER_CONNECTIONS = 6
+
+
+# One user's session: pick a genre and let the artist dropdown update, pick some artists and
+# a year range (which updates the dropdown again), press "Plot!", then search a compare artist
+# and plot again. record(step, start, seconds, requests, error) is called for every step.
+def loadtest_session(client, rng, genres, years, record, deadline, think_time):
+    def step(name, values):
+        if time.perf_counter() >= deadline:
+            raise TimeoutError
+        if think_time:
+            time.sleep(rng.uniform(0, 2 * think_time))
+        start = time.perf_counter()
+        try:
+            responses, requests = client.change(LOADTEST_STEPS[name], values)
+        except Exception:
+            record(name, start, time.perf_counter() - start, 0, True)
+            raise
+        record(name, start, time.perf_counter() - start, requests, False)
+        return responses
+
+    values = {'genre-dropdown.value': rng.choice(genres), 'start-year.value': years[0], 'end-year.value': years[-1],
+              'artists-dropdown.value': [], 'artists-dropdown-compare.value': None, 'submit-button.n_clicks': 0}
+
+    artists = option_values(step('genre change', values), 'artists-dropdown')
+    if not artists:
+        return
+    values['artists-dropdown.value'] = rng.sample(artists, min(len(artists), rng.randint(1, 5)))
+    start_year = rng.choice(years)
+    values['start-year.value'] = start_year
+    values['end-year.value'] = rng.choice([year for year in years if year >= start_year])
+    step('year change', values)
+
+    values['submit-button.n_clicks'] += 1
+    step('plot', values)
+
+    search = rng.choice(artists)[:2]
+    values['artists-dropdown-compare.search_value'] = search
+    compare_artists = option_values(step('compare search', values), 'artists-dropdown-compare')
+    if not compare_artists:
+        return
+    values['artists-dropdown-compare.value'] = rng.choice(compare_artists)
+    values['submit-button.n_clicks'] += 1
+    step('plot + compare', values)
+
+
+# pids of process and of all its descendants
+def process_tree(pid):
+    parents = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as stat:
+                    parents[int(name)] = int(stat.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError):
+                continue
+    tree = [pid]
+    for process in tree:
+        tree += [child for child, parent in parents.items() if parent == process]
+    return tree
+
+
+# (PSS, RSS) of a process in bytes; PSS splits the pages shared copy-on-write between processes
+def process_memory(pid):
+    sizes = {}
+    with open(f'/proc/{pid}/smaps_rollup') as smaps:
+        for line in smaps:
+            field = line.split()
+            if field[0] in ('Pss:', 'Rss:'):
+                sizes[field[0]] = int(field[1]) * 1024
+    return sizes.get('Pss:', 0), sizes.get('Rss:', 0)
+
+
+# Peak total PSS of the gunicorn master and its workers, and the peak RSS of any one of them
+def sample_memory(pid, peaks, stop, interval=0.5):
+    while not stop.wait(interval):
+        total_pss = 0
+        for process in process_tree(pid):
+            try:
+                pss, rss = process_memory(process)
+            except OSError:
+                continue
+            total_pss += pss
+            peaks['rss'] = max(peaks['rss'], rss)
+        peaks['pss'] = max(peaks['pss'], total_pss)
+
+
+def loadtest_run(args, workers, threads):
+    server = None
+    if args.url:
+        url = urllib.parse.urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = '127.0.0.1', args.port
+        repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+                                   '--bind', f'{host}:{port}', '--workers', str(workers), '--threads', str(threads)],
+                                  cwd=repository, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(int(args.startup_timeout / 0.25)):
+            if server is not None and server.poll() is not None:
+                sys.exit(f"gunicorn exited with status {server.returncode}")
+            try:
+                client = DashClient(host, port)
+                break
+            except (OSError, http.client.HTTPException, RuntimeError):
+                time.sleep(0.25)
+        else:
+            sys.exit(f"the dashboard did not answer on {host}:{port} within {args.startup_timeout}s")
+        layout = client.request('GET', '/_dash-layout')
+        genres = dropdown_values(find_component(layout, 'genre-dropdown')['options'])
+        year_domain = find_component(layout, 'year-domain')
+        # layouts without the year-domain store list the years in the start year dropdown
+        years = year_domain['data'] if year_domain is not None else \
+            dropdown_values(find_component(layout, 'start-year')['options'])
+
+        samples = []
+        lock = threading.Lock()
+        measure_start = time.perf_counter() + args.warmup
+        deadline = measure_start + args.duration
+
+        def record(step, start, seconds, requests, error):
+            if start >= measure_start and start + seconds <= deadline:
+                with lock:
+                    samples.append((step, seconds, requests, error))
+
+        def user(number):
+            rng = random.Random(f'{args.seed}-{number}')
+            while time.perf_counter() < deadline:
+                try:
+                    loadtest_session(client, rng, genres, years, record, deadline, args.think_time)
+                except TimeoutError:
+                    break
+                except Exception:
+                    continue
+
+        peaks = {'pss': 0, 'rss': 0}
+        stop = threading.Event()
+        sampler = None
+        if server is not None:
+            sampler = threading.Thread(target=sample_memory, args=(server.pid, peaks, stop), daemon=True)
+            sampler.start()
+        users = [threading.Thread(target=user, args=(number,)) for number in range(args.users)]
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+        stop.set()
+        if sampler is not None:
+            sampler.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    steps = {}
+    requests = {}
+    for step, seconds, step_requests, error in samples:
+        latencies, errors = steps.setdefault(step, ([], []))
+        (errors if error else latencies).append(seconds)
+        requests[step] = requests.get(step, 0) + step_requests
+    result = {'workers': workers if server is not None else None, 'threads': threads if server is not None else None,
+              'users': args.users, 'duration': args.duration,
+              'requests_per_second': sum(requests.values()) / args.duration,
+              'server_pss_mib': peaks['pss'] / 2 ** 20 if server is not None else None,
+              'largest_rss_mib': peaks['rss'] / 2 ** 20 if server is not None else None,
+              'steps': {}}
+    for step in [step for step in LOADTEST_STEPS if step in steps]:
+        latencies, errors = steps[step]
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 \
+            else latencies * 99
+        result['steps'][step] = {'steps': len(latencies), 'errors': len(errors),
+                                 'requests_per_step': requests[step] / len(latencies) if latencies else None,
+                                 'p50_ms': percentiles[49] * 1000 if latencies else None,
+                                 'p95_ms': percentiles[94] * 1000 if latencies else None,
+                                 'p99_ms': percentiles[98] * 1000 if latencies else None}
+    return result
+
+
+# Throughput, latency percentiles per session step and server memory under concurrent users,
+# for every combination of gunicorn workers and threads (or for an already running server)
+def loadtest(args):
+    configurations = [(None, None)] if args.url else [(workers, threads) for workers in args.workers
+                                                      for threads in args.threads]
+    results = []
+    for workers, threads in configurations:
+        result = loadtest_run(args, workers, threads)
+        results.append(result)
+        server = f"{workers} workers x {threads} threads" if workers is not None else args.url
+        memory = (f", server {result['server_pss_mib']:,.1f} MiB PSS (largest process "
+                  f"{result['largest_rss_mib']:,.1f} MiB RSS)" if workers is not None else '')
+        print(f"{server}, {args.users} users: {result['requests_per_second']:.1f} requests/s{memory}")
+        print(f"  {'step':<16} {'input changed':<38} {'steps':>7} {'requests':>9} {'errors':>7} {'p50 ms':>9} "
+              f"{'p95 ms':>9} {'p99 ms':>9}")
+        for step, stats in result['steps'].items():
+            requests, p50, p95, p99 = (f"{stats[key]:9.1f}" if stats[key] is not None else f"{'-':>9}"
+                                       for key in ['requests_per_step', 'p50_ms', 'p95_ms', 'p99_ms'])
+            print(f"  {step:<16} {LOADTEST_STEPS[step]:<38} {stats['steps']:7} {requests} {stats['errors']:7} "
+                  f"{p50} {p95} {p99}")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the dashboard outside of a running server.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    spec_parser = subparsers.add_parser('spec-size', help='serialized chart spec size before/after server-side '
+                                                          'aggregation; defaults to the five most prolific '
+                                                          'artists over every release year')
+    spec_parser.add_argument('--artists', nargs='+')
+    spec_parser.add_argument('--start-year', type=int)
+    spec_parser.add_argument('--end-year', type=int)
+    spec_parser.add_argument('--row-cap', type=int, default=int(os.environ.get('SPOTIFY_SCATTER_ROW_CAP', 500)))
+    spec_parser.set_defaults(func=spec_size)
+
+    memory_parser = subparsers.add_parser('memory', help='per-worker memory of the tracks table with a plain '
+                                                         'pd.read_parquet versus utils.load_tracks')
+    memory_parser.add_argument('--path', help='defaults to the processed tracks file read by the app')
+    memory_parser.add_argument('--loader', choices=['plain', 'optimized'], help=argparse.SUPPRESS)
+    memory_parser.set_defaults(func=memory)
+
+    genres_parser = subparsers.add_parser('genres', help='startup cost of parsing the stringified genres, '
+                                                         'per row (with and without the former joblib disk '
+                                                         'cache) versus utils.parse_genres')
+    genres_parser.add_argument('--path', help='defaults to the processed tracks file read by the app')
+    genres_parser.add_argument('--rows', type=int, default=20000,
+                               help='number of rows to parse, 0 for all (the joblib path is slow)')
+    genres_parser.set_defaults(func=genres)
+
+    startup_parser = subparsers.add_parser('startup', help='cold start time of the dashboard per phase')
+    startup_parser.add_argument('--budget', type=float,
+                                help='exit with an error if the cold start takes longer than this many seconds')
+    startup_parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    startup_parser.set_defaults(func=startup)
+
+    benchmark_parser = subparsers.add_parser('benchmark', help='latency, peak memory and response size of each '
+                                                               'callback on a dataset scaled to several sizes')
+    benchmark_parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                                  help='copies of the processed tracks in each synthetic dataset (100 needs '
+                                       'several GiB of memory)')
+    benchmark_parser.add_argument('--repeat', type=int, default=5,
+                                  help='cold calls per callback and case, the median is reported')
+    benchmark_parser.add_argument('--output', help='also write the results to this JSON file')
+    benchmark_parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    benchmark_parser.add_argument('--generate', metavar='DIR', help=argparse.SUPPRESS)
+    benchmark_parser.set_defaults(func=benchmark)
+
+    specs_parser = subparsers.add_parser('specs', help='check that the template chart specs equal the Altair ones '
+                                                       'and time both builders')
+    specs_parser.add_argument('--samples', type=int, default=50,
+                              help='random submissions checked on top of the benchmark ones')
+    specs_parser.add_argument('--seed', type=int, default=0)
+    specs_parser.add_argument('--repeat', type=int, default=5,
+                              help='timed calls per builder and benchmark case, the median is reported')
+    specs_parser.set_defaults(func=specs)
+
+    loadtest_parser = subparsers.add_parser('loadtest', help='throughput, latency percentiles and server memory '
+                                                             'under concurrent simulated users, per gunicorn '
+                                                             'worker and thread count')
+    loadtest_parser.add_argument('--users', type=int, default=8, help='concurrent simulated users')
+    loadtest_parser.add_argument('--duration', type=float, default=30, help='measured seconds per configuration')
+    loadtest_parser.add_argument('--warmup', type=float, default=5,
+                                 help='seconds of load before the measurement starts')
+    loadtest_parser.add_argument('--workers', type=int, nargs='+', default=[2, 4], help='gunicorn worker counts')
+    loadtest_parser.add_argument('--threads', type=int, nargs='+', default=[1], help='gunicorn thread counts')
+    loadtest_parser.add_argument('--think-time', type=float, default=0,
+                                 help='mean seconds a user waits before each step; 0 sends requests back to back')
+    loadtest_parser.add_argument('--port', type=int, default=8077, help='port of the gunicorn servers started')
+    loadtest_parser.add_argument('--url', help='load an already running dashboard instead of starting gunicorn')
+    loadtest_parser.add_argument('--startup-timeout', type=float, default=120)
+    loadtest_parser.add_argument('--seed', type=int, default=0)
+    loadtest_parser.add_argument('--output', help='also write the results to this JSON file')
+    loadtest_parser.set_defaults(func=loadtest)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
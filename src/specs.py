@@ -0,0 +1,164 @@
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+import src.utils as ut
+
+# The Vega-Lite specs of the dashboard charts, written out as dictionaries. They are the
+# specs charts.py gets from Altair's to_dict() for the same data, so filling them in skips
+# building the Altair objects, validating them against the schema and deep-copying the data.
+# `python src/profiling.py specs` checks that both give the same spec and times them.
+
+SCHEMA = 'https://vega.github.io/schema/vega-lite/v5.17.0.json'
+CONFIG = {'view': {'continuousWidth': 300, 'continuousHeight': 300}}
+ARTIST_COLORS = ['#FFEEAF', '#A8CD9F', '#57CC99', '#438A70', '#12372A']
+
+
+# JSON-ready rows of a DataFrame, converted like altair.utils.sanitize_dataframe: numpy scalars
+# and arrays become Python values and lists, and missing or infinite values become None
+def records(df):
+    columns = []
+    for name, column in df.items():
+        values = column.tolist()
+        if pd.api.types.is_float_dtype(column.dtype):
+            missing = ~np.isfinite(column.to_numpy())
+        else:
+            missing = column.isna().to_numpy()
+            if column.dtype == object:
+                values = [value.tolist() if isinstance(value, np.ndarray) else value for value in values]
+        if missing.any():
+            values = [None if is_missing else value for value, is_missing in zip(values, missing)]
+        columns.append(values)
+    names = [str(name) for name in df.columns]
+    return [dict(zip(names, row)) for row in zip(*columns)] if names else [{}] * len(df)
+
+
+# Name Altair gives an inline dataset in the top-level "datasets" of a spec
+def dataset_name(values):
+    if values == [{}]:
+        return 'empty'
+    values_json = json.dumps(values, sort_keys=True, default=str)
+    return 'data-' + hashlib.sha256(values_json.encode()).hexdigest()[:32]
+
+
+# The top-level spec around a chart, with its data moved to "datasets" as Altair does
+# (a dataset shared by two layers, like two empty ones, is stored once)
+def chart_spec(chart, *datasets):
+    return {'config': CONFIG, **chart, '$schema': SCHEMA, 'datasets': {name: values for dataset in datasets
+                                                                       for name, values in dataset.items()}}
+
+
+def _dataset(df):
+    values = records(df)
+    name = dataset_name(values)
+    return {'name': name}, {name: values}
+
+
+# an encoding channel, with its properties in Altair's (alphabetical) order
+def _field(name, type, **properties):
+    return dict(sorted({**properties, 'field': name, 'type': type}.items()))
+
+
+def _mean_popularity(**properties):
+    return _field('popularity', 'quantitative', aggregate='mean', **properties)
+
+
+# axis of the release years in the range, ticked at the given years (numpy numbers, which
+# Altair writes out as floats)
+def _year_axis(years, start_year, end_year):
+    return {'axis': {'format': '0', 'values': [float(year) for year in years]}, 'field': 'release_year',
+            'scale': {'domain': [int(start_year), int(end_year)]}, 'title': 'Release Year',
+            'type': 'quantitative'}
+
+
+def artist_time_chart(popularity_df, selected_artists, start_year, end_year, compare_df=None, compare_artist=None):
+    popularity_df = ut.decategorize(popularity_df)
+    tooltip = [_field('artist', 'nominal'), _field('release_year', 'quantitative'), _mean_popularity()]
+    encoding = {
+        'color': _field('artist', 'nominal', legend={'title': 'Artist'},
+                        scale={'domain': list(selected_artists), 'range': ARTIST_COLORS}),
+        'tooltip': tooltip,
+        'x': _year_axis(sorted(popularity_df['release_year'].unique()), start_year, end_year),
+        'y': _mean_popularity(title='Popularity')
+    }
+    data, datasets = _dataset(popularity_df)
+    layers = [{'mark': {'type': 'point'}, 'encoding': encoding}, {'mark': {'type': 'line'}, 'encoding': encoding}]
+    if compare_artist is None:
+        return chart_spec({'layer': layers, 'data': data, 'height': 180, 'width': 250}, datasets)
+
+    compare_encoding = {
+        'color': _field('artist', 'nominal', legend={'title': 'Compare'},
+                        scale={'domain': [compare_artist], 'range': ['red']}),
+        'tooltip': tooltip,
+        'x': _field('release_year', 'quantitative'),
+        'y': _mean_popularity(title='Popularity')
+    }
+    compare_data, compare_datasets = _dataset(ut.decategorize(compare_df))
+    compare_layers = [{'mark': {'type': 'point', 'color': 'red'}, 'encoding': compare_encoding},
+                      {'mark': {'type': 'line', 'color': 'red'}, 'encoding': compare_encoding}]
+    return chart_spec({'layer': [{'layer': layers, 'data': data}, {'layer': compare_layers, 'data': compare_data}],
+                       'height': 180, 'resolve': {'scale': {'color': 'independent'}}, 'width': 250},
+                      datasets, compare_datasets)
+
+
+def explicit_chart(merged_df):
+    data, datasets = _dataset(ut.decategorize(merged_df))
+    return chart_spec({
+        'config': {'view': dict(CONFIG['view'], stroke='transparent')},
+        'data': data,
+        'mark': {'type': 'bar'},
+        'encoding': {
+            'color': _field('song_type', 'nominal', legend={'title': 'Song Type'}, scale={'scheme': 'greens'}),
+            'column': _field('artist', 'nominal', header={'labelOrient': 'bottom', 'title': None}),
+            'x': _field('adjusted_song_type', 'nominal',
+                        axis={'labelAngle': 0, 'labels': True, 'ticks': True, 'title': None}),
+            'y': _field('popularity', 'quantitative', axis={'grid': False, 'title': 'Mean Popularity'})
+        },
+        'height': 170,
+        'transform': [{'calculate': "if((datum.song_type === 'Clean'),'C','E')", 'as': 'adjusted_song_type'}],
+        'width': 25
+    }, datasets)
+
+
+def top_songs_chart(tracks_df_top_five):
+    data, datasets = _dataset(ut.decategorize(tracks_df_top_five))
+    return chart_spec({
+        'data': data,
+        'mark': {'type': 'bar'},
+        'encoding': {
+            'color': _field('artist', 'nominal', legend=None, scale={'scheme': 'greens'}),
+            'tooltip': [_field('artist', 'nominal'), _field('release_year', 'quantitative')],
+            'x': _field('name', 'nominal', axis={'labelAngle': -15}, sort='-y', title='Song Name'),
+            'y': _field('popularity', 'quantitative', title='Popularity')
+        },
+        'height': 166,
+        'width': 350
+    }, datasets)
+
+
+# scatter_df already has its speechiness_label column and lines_df holds the fitted regression
+# lines; without lines_df the regression is left to Vega, fitted on every point of scatter_df
+def speechiness_chart(scatter_df, lines_df, unique_years, start_year, end_year):
+    encoding = {
+        'color': _field('speechiness_label', 'nominal', legend={'title': 'Speechiness'}, scale={'scheme': 'greens'}),
+        'tooltip': [_field('artist', 'nominal'), _field('name', 'nominal'), _field('release_year', 'quantitative'),
+                    _field('popularity', 'quantitative')],
+        'x': _year_axis(unique_years, start_year, end_year),
+        'y': _field('popularity', 'quantitative', title='Popularity')
+    }
+    data, datasets = _dataset(scatter_df)
+    points = {'mark': {'type': 'point', 'opacity': 0.7}, 'encoding': encoding}
+    if lines_df is None:
+        regression = {'mark': {'type': 'line'}, 'encoding': encoding,
+                      'transform': [{'on': 'release_year', 'regression': 'popularity',
+                                     'groupby': ['speechiness_label']}]}
+        return chart_spec({'layer': [points, regression], 'data': data, 'height': 180, 'width': 200}, datasets)
+
+    lines_data, lines_datasets = _dataset(lines_df)
+    lines = {'data': lines_data, 'mark': {'type': 'line'}, 'encoding': {
+        'color': _field('speechiness_label', 'nominal', scale={'scheme': 'greens'}),
+        'x': _field('release_year', 'quantitative'),
+        'y': _field('popularity', 'quantitative')
+    }}
+    return chart_spec({'layer': [{'data': data, **points}, lines], 'height': 180, 'width': 200},
+                      datasets, lines_datasets)
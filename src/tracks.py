@@ -0,0 +1,151 @@
+import heapq
+import os
+from functools import lru_cache
+from itertools import islice
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import src.utils as ut
+
+
+# Both stores answer the same questions: the tracks of some artists in a year range, and
+# the summaries the dropdowns and indexes are built from at startup. InMemoryTracks holds
+# the whole table in the worker; DatasetTracks reads only the matching rows from the
+# partitioned parquet dataset on every query, so the catalogue does not have to fit in RAM.
+
+# Dataset scans kept per DatasetTracks, so that the queries of one submission (its tracks and
+# their top k) read the dataset once
+DATASET_QUERY_CACHE_SIZE = 16
+
+# Tracks held in memory, filtered through the sorted artist index
+class InMemoryTracks:
+    def __init__(self, tracks_df):
+        self.tracks_df = ut.sort_tracks(tracks_df)
+        self.artist_index = ut.create_artist_index(self.tracks_df)
+        self.popularity_order = ut.create_popularity_order(self.tracks_df)
+        self._release_years = self.tracks_df['release_year'].to_numpy()
+        self._popularity = self.tracks_df['popularity'].to_numpy()
+
+    def query(self, artists, start_year, end_year):
+        return ut.filter_tracks(self.tracks_df, self.artist_index, artists, start_year, end_year)
+
+    # the k most popular tracks of the artists in the year range, most popular first. Each
+    # artist's block of popularity_order is already sorted, so its first k tracks in the range
+    # are its candidates, and a k-way merge of those short lists yields the overall top k.
+    def top_tracks(self, artists, start_year, end_year, k):
+        candidates = []
+        for artist in artists:
+            if artist not in self.artist_index:
+                continue
+            start, stop = self.artist_index[artist]
+            positions = self.popularity_order[start:stop]
+            years = self._release_years[positions]
+            positions = positions[(years >= start_year) & (years <= end_year)][:k]
+            # ties are broken by row position, like DataFrame.nlargest(keep='first')
+            candidates.append(list(zip((-self._popularity[positions]).tolist(), positions.tolist())))
+        top = [position for _, position in islice(heapq.merge(*candidates), k)]
+        return self.tracks_df.take(np.array(top, dtype='int64'))
+
+    def release_years(self):
+        return sorted(self.tracks_df['release_year'].unique().tolist())
+
+    # number of tracks per genre, most common first
+    def genre_counts(self):
+        return self.tracks_df['genres'].explode().value_counts()
+
+    # genres, release_year and artist of the tracks, as expected by utils.create_genre_index
+    def genre_artist_years(self):
+        return self.tracks_df[['genres', 'release_year', 'artist']]
+
+    # mean popularity of each artist
+    def artist_popularity(self, cube_df):
+        return self.tracks_df.groupby('artist', observed=True)['popularity'].mean()
+
+
+# Tracks read from the parquet dataset written by src/preprocess.py. Queries push the artist
+# and year filters down to the scan, which skips whole partitions and, through the sorted
+# row groups' artist statistics, most row groups of the partitions it reads.
+class DatasetTracks:
+    # Given the store of an earlier version of the same dataset, files it has already read are
+    # not scanned again when the dataset only gained files since; appended_files then lists the
+    # new ones (it is None after a full load).
+    def __init__(self, path, previous=None):
+        self.path = path
+        self.dataset = ut.open_tracks_dataset(path)
+        self.files = {file: _file_signature(file) for file in self.dataset.files}
+        self.appended_files = None
+        self._query = lru_cache(maxsize=DATASET_QUERY_CACHE_SIZE)(self._scan)
+        self._genre_counts = None
+        self._genre_artist_years = None
+        if previous is not None and all(self.files.get(file) == signature
+                                        for file, signature in previous.files.items()):
+            self.appended_files = [file for file in self.files if file not in previous.files]
+            previous._scan_genres()
+            self._genre_counts, self._genre_artist_years = self._scan_genres_of(
+                self.appended_files, previous._genre_counts, previous._genre_artist_years)
+
+    # the returned frame is shared by the cached scan and must be treated as read-only
+    def query(self, artists, start_year, end_year):
+        return self._query(tuple(artists), int(start_year), int(end_year))
+
+    # the k most popular tracks of the artists in the year range, most popular first, taken
+    # from the (cached) query instead of a second scan
+    def top_tracks(self, artists, start_year, end_year, k):
+        return self.query(artists, start_year, end_year).nlargest(k, 'popularity')
+
+    def _scan(self, artists, start_year, end_year):
+        table = self.dataset.to_table(
+            columns=ut.TRACK_COLUMNS,
+            filter=ds.field('artist').isin(list(artists)) & (ds.field('release_year') >= int(start_year))
+            & (ds.field('release_year') <= int(end_year)))
+        tracks_df = table.to_pandas().sort_values(['artist', 'release_year'], kind='stable', ignore_index=True)
+        return ut.prepare_tracks(tracks_df)
+
+    def release_years(self):
+        # a partition holds several files once tracks are appended to it
+        return sorted({ds.get_partition_keys(fragment.partition_expression)['release_year']
+                       for fragment in self.dataset.get_fragments()})
+
+    def genre_counts(self):
+        self._scan_genres()
+        return self._genre_counts
+
+    def genre_artist_years(self):
+        self._scan_genres()
+        return self._genre_artist_years
+
+    # mean popularity of each artist, from the summed cube instead of a scan of every track
+    def artist_popularity(self, cube_df):
+        sums = cube_df.groupby('artist', observed=True)[['count', 'popularity_sum']].sum()
+        return sums['popularity_sum'] / sums['count']
+
+    # cube aggregates of the appended files, to be added to the cube of the previous version
+    def appended_cube(self):
+        columns = ['artist', 'release_year', 'explicit'] + ut.CUBE_MEASURES
+        tracks_df = ut.open_tracks_dataset(self.path, self.appended_files).to_table(columns=columns).to_pandas()
+        return ut.create_track_cube(tracks_df)
+
+    def _scan_genres(self):
+        if self._genre_counts is None:
+            self._genre_counts, self._genre_artist_years = self._scan_genres_of(list(self.files))
+
+    # one pass over the genres column of the given files, batch by batch, keeping only the
+    # genre counts and the distinct (genre, release year, artist) combinations, added to
+    # those of the previously scanned files if given
+    def _scan_genres_of(self, files, genre_counts=None, genre_artist_years=None):
+        counts = [genre_counts] if genre_counts is not None else []
+        combinations = [genre_artist_years] if genre_artist_years is not None else []
+        for batch in ut.open_tracks_dataset(self.path, files).to_batches(columns=['genres', 'release_year', 'artist']):
+            exploded = batch.to_pandas().explode('genres').dropna(subset=['genres'])
+            counts.append(exploded['genres'].value_counts())
+            combinations.append(exploded.drop_duplicates())
+        genre_counts = (pd.concat(counts).groupby(level=0).sum().sort_values(ascending=False, kind='stable')
+                        if counts else pd.Series(dtype='int64'))
+        genre_artist_years = (pd.concat(combinations, ignore_index=True).drop_duplicates() if combinations
+                              else pd.DataFrame(columns=['genres', 'release_year', 'artist']))
+        return genre_counts, genre_artist_years
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,85 @@
+import gzip
+import os
+import dash
+import flask
+from plotly.io.json import to_json_plotly
+import src.metrics as metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses of at least this many bytes are compressed for the clients accepting it, with
+# brotli when the brotli package is installed and gzip otherwise; 0 disables compression
+COMPRESS_MIN_BYTES = int(os.environ.get('SPOTIFY_COMPRESS_MIN_BYTES', 1024))
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'text/')
+# Characters escaped as plotly does, since Dash also writes JSON into <script> tags of the page
+SAFE_JSON = [('<', '\\u003c'), ('>', '\\u003e'), ('/', '\\u002f'), ('\u2028', '\\u2028'), ('\u2029', '\\u2029')]
+# Fast settings: the responses are compressed on every request, not once ahead of time
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+# Drop-in for Dash's to_json: orjson, with Dash components turned into their JSON form, and
+# plotly's encoder (the one Dash uses) for anything orjson cannot serialize
+def to_json(value):
+    if orjson is None:
+        return to_json_plotly(value)
+    try:
+        encoded = orjson.dumps(value, default=_plotly_json,
+                               option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        return to_json_plotly(value)
+    encoded = encoded.decode()
+    for unsafe, safe in SAFE_JSON:
+        if unsafe in encoded:
+            encoded = encoded.replace(unsafe, safe)
+    return encoded
+
+
+def _plotly_json(value):
+    if hasattr(value, 'to_plotly_json'):
+        return value.to_plotly_json()
+    raise TypeError
+
+
+# body compressed for the Accept-Encoding of the request, and its encoding, or None
+def compress(body, accept_encodings):
+    if brotli is not None and accept_encodings['br']:
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if accept_encodings['gzip']:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+    return None
+
+
+# Serialize the callback responses, layout and dependencies of app with to_json, compress the
+# server's responses, and record the bytes each callback sends when metrics are enabled
+def init_app(app):
+    dash._callback.to_json = to_json
+    dash.dash.to_json = to_json
+
+    @app.server.after_request
+    def compress_response(response):
+        if response.direct_passthrough or response.status_code != 200 or 'Content-Encoding' in response.headers:
+            return response
+        body = response.get_data()
+        wire_bytes = len(body)
+        if (COMPRESS_MIN_BYTES > 0 and wire_bytes >= COMPRESS_MIN_BYTES
+                and response.mimetype.startswith(COMPRESSIBLE_TYPES)):
+            compressed = compress(body, flask.request.accept_encodings)
+            if compressed is not None:
+                response.set_data(compressed[0])
+                response.headers['Content-Encoding'] = compressed[1]
+                response.vary.add('Accept-Encoding')
+                wire_bytes = len(compressed[0])
+        if metrics.ENABLED and flask.request.path.endswith('/_dash-update-component'):
+            callback = app.callback_map.get((flask.request.get_json(silent=True) or {}).get('output'), {})
+            if 'callback' in callback:
+                metrics.record_response(callback['callback'].__name__, len(body), wire_bytes)
+        return response
@@ -1,9 +1,65 @@
 import ast
-import joblib
+import hashlib
+import heapq
+import importlib
+import os
+import sys
+import time
+import types
+import warnings
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+AUDIO_FEATURES = ['danceability', 'energy', 'loudness', 'speechiness', 'acousticness', 'instrumentalness',
+                  'liveness', 'valence']
+CUBE_MEASURES = ['popularity'] + AUDIO_FEATURES
+# Columns of tracks_processed.parquet used by the dashboard
+TRACK_COLUMNS = ['name', 'artist', 'genres', 'release_year', 'popularity', 'explicit',
+                 'speechiness_binned'] + AUDIO_FEATURES
+
+# Directory of the processed files, overridable to serve another (e.g. synthetic) dataset
+DATA_DIR = os.environ.get('SPOTIFY_DATA_DIR', 'data/processed')
+TRACKS_PATH = os.path.join(DATA_DIR, 'tracks_processed.parquet')
+CUBE_PATH = os.path.join(DATA_DIR, 'tracks_cube.parquet')
+# Parquet dataset written by src/preprocess.py: one hive partition per release year, sorted by
+# artist within each partition, so that year and artist filters skip unneeded row groups
+TRACKS_DATASET_PATH = os.path.join(DATA_DIR, 'tracks_dataset')
+
+# Seconds spent in each startup phase of this process, see startup_phase
+STARTUP_TIMINGS = {}
+
+
+@contextmanager
+def startup_phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = STARTUP_TIMINGS.get(name, 0) + time.perf_counter() - start
+
+
+# import a module on first attribute access instead of right away. The import goes through
+# importlib.import_module, whose per-module lock makes threads touching the module at once wait
+# for the complete module (importlib.util.LazyLoader is not thread-safe before Python 3.12).
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
+
+
+class _LazyModule(types.ModuleType):
+    # only called for attributes not copied from the imported module yet
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
 
-memory = joblib.Memory("tmp", verbose=0)
 
-@memory.cache()
 def convert_string_to_list(string):
     try:
         return ast.literal_eval(string)
@@ -12,11 +68,259 @@ def convert_string_to_list(string):
         return []
 
 
-# convert stringified lists into actual lists
-@memory.cache()
-def create_genre_dropdown_options(tracks_df):
-    tracks_df['genres'] = tracks_df['genres'].apply(convert_string_to_list)
-    genres_exploded = tracks_df.explode('genres')
-    genre_counts = genres_exploded['genres'].value_counts()
+# convert a column of stringified lists into actual lists. Every track of an artist
+# carries the same genres string, so each distinct string is parsed once and the
+# resulting list is shared by all rows holding it.
+def parse_genres(genres):
+    codes, uniques = pd.factorize(genres)
+    parsed = np.empty(len(uniques) + 1, dtype=object)
+    parsed[:-1] = [convert_string_to_list(string) for string in uniques]
+    # factorize codes missing values as -1, which picks the trailing empty list
+    parsed[-1] = []
+    return pd.Series(parsed[codes], index=genres.index, name=genres.name)
+
+
+# sha256 of a file's contents, used to key the caches of data loaded from it. Digests
+# are remembered per modification time and size so a file is only hashed once.
+def file_digest(path):
+    stat = os.stat(path)
+    return _file_digest(path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=16)
+def _file_digest(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# read only the columns the dashboard uses, with compact dtypes: artist as a
+# categorical, small integers downcast and the audio features as float32. The table is
+# read once per process, so it is not memoized: a cached copy would outlive the sorted
+# frame the dashboard keeps and double its memory.
+def load_tracks(path):
+    with startup_phase('parquet read'):
+        tracks_df = prepare_tracks(pd.read_parquet(path, columns=TRACK_COLUMNS))
+    with startup_phase('genre parse'):
+        # files written before genres were stored as a list column hold stringified lists
+        first_genres = tracks_df['genres'].first_valid_index()
+        if first_genres is not None and isinstance(tracks_df['genres'].loc[first_genres], str):
+            tracks_df['genres'] = parse_genres(tracks_df['genres'])
+    return tracks_df
+
+
+# compact dtypes for a frame of TRACK_COLUMNS: categorical artist, the smallest integer
+# types holding the values and float32 audio features
+def prepare_tracks(tracks_df):
+    tracks_df['artist'] = tracks_df['artist'].astype('category')
+    for column in ['release_year', 'popularity', 'explicit', 'speechiness_binned']:
+        tracks_df[column] = pd.to_numeric(tracks_df[column], downcast='integer')
+    tracks_df[AUDIO_FEATURES] = tracks_df[AUDIO_FEATURES].astype('float32')
+    return tracks_df
+
+
+# the parquet dataset written by src/preprocess.py, with release_year read from its partitions;
+# given files, only those files of the dataset
+def open_tracks_dataset(path, files=None):
+    partitioning = ds.partitioning(pa.schema([('release_year', pa.int64())]), flavor='hive')
+    if files is not None:
+        return ds.dataset(files, format='parquet', partitioning=partitioning, partition_base_dir=path)
+    return ds.dataset(path, format='parquet', partitioning=partitioning)
+
+
+# sha256 of the names, sizes and modification times of the files of a dataset directory,
+# a cheap stand-in for file_digest that changes whenever a partition is rewritten
+def dataset_digest(path):
+    digest = hashlib.sha256()
+    for root, dirs, files in sorted(os.walk(path)):
+        dirs.sort()
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            digest.update(f'{os.path.relpath(os.path.join(root, name), path)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+# sort tracks by artist and then release_year as expected by create_artist_index,
+# returning the frame untouched when it is already in that order
+def sort_tracks(tracks_df):
+    artist_steps = np.diff(tracks_df['artist'].cat.codes.to_numpy())
+    year_steps = np.diff(tracks_df['release_year'].to_numpy())
+    if np.all((artist_steps > 0) | ((artist_steps == 0) & (year_steps >= 0))):
+        return tracks_df
+    return tracks_df.sort_values(['artist', 'release_year'], kind='stable', ignore_index=True)
+
+
+# drop the categorical dtype before handing a frame to Altair, which would otherwise
+# encode the column as ordinal and embed every category in the spec
+def decategorize(df):
+    categorical = df.select_dtypes('category').columns
+    return df.astype({column: object for column in categorical}) if len(categorical) else df
+
+
+# genres ordered from the most to the least tracks
+def create_genre_dropdown_options(genre_counts):
     genre_dropdown_options = [{'label': genre, 'value': genre} for genre in genre_counts.index]
-    return genre_dropdown_options
\ No newline at end of file
+    return genre_dropdown_options
+
+
+# map each artist to the [start, stop) row positions of their tracks;
+# expects tracks_df to be sorted by artist and then release_year
+def create_artist_index(tracks_df):
+    artists = tracks_df['artist'].to_numpy()
+    if len(artists) == 0:
+        return {}
+    starts = np.flatnonzero(np.r_[True, artists[1:] != artists[:-1]])
+    stops = np.r_[starts[1:], len(artists)]
+    return dict(zip(artists[starts], zip(starts.tolist(), stops.tolist())))
+
+
+# row positions of tracks_df ordered by artist, then by descending popularity and then by
+# position, so that each artist's block (as in create_artist_index) lists their tracks from
+# the most to the least popular
+def create_popularity_order(tracks_df):
+    positions = np.arange(len(tracks_df))
+    return np.lexsort((positions, -tracks_df['popularity'].to_numpy(dtype='int64'),
+                       tracks_df['artist'].cat.codes.to_numpy()))
+
+
+# select the tracks of the given artists released between start_year and end_year
+# using binary searches inside each artist's block instead of a full boolean mask
+def filter_tracks(tracks_df, artist_index, artists, start_year, end_year):
+    release_years = tracks_df['release_year'].to_numpy()
+    positions = []
+    for artist in artists:
+        if artist not in artist_index:
+            continue
+        start, stop = artist_index[artist]
+        years = release_years[start:stop]
+        first = start + np.searchsorted(years, start_year, side='left')
+        last = start + np.searchsorted(years, end_year, side='right')
+        positions.append(np.arange(first, last))
+    if not positions:
+        return tracks_df.iloc[0:0]
+    return tracks_df.take(np.sort(np.concatenate(positions)))
+
+
+# map each genre to the release years and artists of its tracks, sorted by year,
+# so artists for a genre and year range can be looked up without a per-row scan
+def create_genre_index(tracks_df):
+    genres_exploded = (tracks_df[['genres', 'release_year', 'artist']]
+                       .explode('genres')
+                       .dropna(subset=['genres'])
+                       .drop_duplicates()
+                       .sort_values(['genres', 'release_year'], kind='stable'))
+    return {genre: (group['release_year'].to_numpy(), group['artist'].to_numpy())
+            for genre, group in genres_exploded.groupby('genres', sort=False)}
+
+
+# sorted unique artists with at least one track in the given genres and year range
+def filter_genre_artists(genre_index, genres, start_year, end_year):
+    artists = []
+    for genre in genres:
+        if genre not in genre_index:
+            continue
+        years, genre_artists = genre_index[genre]
+        first = np.searchsorted(years, start_year, side='left')
+        last = np.searchsorted(years, end_year, side='right')
+        artists.append(genre_artists[first:last])
+    if not artists:
+        return []
+    return np.unique(np.concatenate(artists)).tolist()
+
+
+# pre-aggregate tracks into one row per artist, release year and explicit flag holding
+# the track count and the sums of popularity and each audio feature
+def create_track_cube(tracks_df):
+    measures = tracks_df[CUBE_MEASURES].astype('float64').rename(columns=lambda c: f'{c}_sum')
+    grouped = pd.concat([tracks_df[['artist', 'release_year', 'explicit']], measures], axis=1) \
+        .groupby(['artist', 'release_year', 'explicit'], observed=True)
+    cube_df = grouped.sum()
+    cube_df.insert(0, 'count', grouped.size())
+    return cube_df.reset_index()
+
+
+# read the cube written by src/preprocess.py. Given the tracks it summarizes, the cube is
+# built from them instead when the file is missing or counts other tracks, e.g. after
+# preprocess --append added tracks to the dataset only.
+def load_track_cube(path, tracks_df):
+    try:
+        cube_df = pd.read_parquet(path)
+    except FileNotFoundError:
+        if tracks_df is None:
+            raise
+        cube_df = None
+    if tracks_df is not None and (cube_df is None or cube_df['count'].sum() != len(tracks_df)):
+        if cube_df is not None:
+            warnings.warn(f'{path} counts {cube_df["count"].sum()} tracks, not the {len(tracks_df)} loaded; '
+                          'rebuilding it from the tracks')
+        cube_df = create_track_cube(tracks_df)
+    return cube_df.sort_values(['artist', 'release_year'], kind='stable', ignore_index=True)
+
+
+# add up cubes of disjoint sets of tracks into one
+def merge_track_cubes(cube_dfs):
+    cube_df = pd.concat(cube_dfs, ignore_index=True)
+    cube_df['artist'] = cube_df['artist'].astype(str)
+    cube_df = cube_df.groupby(['artist', 'release_year', 'explicit']).sum().reset_index()
+    return cube_df.sort_values(['artist', 'release_year'], kind='stable', ignore_index=True)
+
+
+# turn the summed cube rows into per-group means of the given measures
+def aggregate_cube(cube_df, by, measures):
+    sums = cube_df.groupby(by, observed=True)[['count'] + [f'{m}_sum' for m in measures]].sum()
+    means = pd.DataFrame({m: sums[f'{m}_sum'] / sums['count'] for m in measures})
+    return means.reset_index()
+
+
+# down-sample a frame to at most max_rows rows; the seed keeps repeated queries stable
+def cap_rows(df, max_rows):
+    if len(df) <= max_rows:
+        return df
+    return df.sample(n=max_rows, random_state=0).sort_index()
+
+
+# least squares line of y on x for each group, evaluated at the group's smallest and
+# largest x like Vega-Lite's linear regression transform
+def fit_regression_lines(df, x, y, groupby):
+    lines = []
+    for group, group_df in df.groupby(groupby, observed=True, sort=True):
+        xs = group_df[x].to_numpy(dtype='float64')
+        ys = group_df[y].to_numpy(dtype='float64')
+        if np.unique(xs).size < 2:
+            continue
+        x_mean = xs.mean()
+        slope, intercept = np.polyfit(xs - x_mean, ys, 1)
+        extent = np.array([xs.min(), xs.max()])
+        lines.append(pd.DataFrame({groupby: group, x: extent, y: intercept + slope * (extent - x_mean)}))
+    if not lines:
+        return pd.DataFrame(columns=[groupby, x, y])
+    return pd.concat(lines, ignore_index=True)
+
+
+# prefix index over artist names: every word-suffix of a lowercased name ("taylor swift",
+# "swift") is sorted alongside its artist, so a typed prefix matching the start of any
+# word is resolved with two binary searches. Matches are ranked by popularity, the mean
+# popularity of each artist.
+def create_artist_search_index(popularity):
+    entries = []
+    for artist in popularity.index:
+        words = str(artist).lower().split()
+        entries.extend((' '.join(words[position:]), artist) for position in range(len(words)))
+    entries.sort()
+    ranks = {artist: rank for rank, artist in enumerate(popularity.sort_values(ascending=False, kind='stable').index)}
+    return [key for key, _ in entries], [artist for _, artist in entries], ranks
+
+
+# the most popular artists (at most limit) with a word starting with search_value,
+# optionally restricted to the artists in allowed
+def search_artists(search_index, search_value, limit, allowed=None):
+    keys, artists, ranks = search_index
+    prefix = ' '.join(search_value.lower().split())
+    first = bisect_left(keys, prefix)
+    last = bisect_left(keys, prefix + '\U0010ffff')
+    matches = set(artists[first:last])
+    if allowed is not None:
+        matches &= allowed
+    return heapq.nsmallest(limit, matches, key=ranks.__getitem__)